@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.metrics import registry
+
+UserModel = get_user_model()
+
+# Поля пользователя в снимке: для аутентификации, прав и /users/me/.
+# Хэш пароля в кэш не попадает; остальные поля при обращении
+# догружаются из БД. Порядок - как в модели, этого ждёт from_db().
+SNAPSHOT_FIELDS = [
+    field.attname for field in UserModel._meta.concrete_fields
+    if field.attname in {
+        'id', 'username', 'email', 'first_name', 'last_name',
+        'is_active', 'is_staff', 'is_superuser',
+    }
+]
+
+auth_cache_requests = registry.counter(
+    'foodgram_auth_token_cache_requests_total',
+    'Проверки токена: hit - из кэша, miss - запросом к БД.',
+    ('result',),
+)
+
+
+class TokenCache:
+    """
+    Снимки «токен -> пользователь»: ограниченный по размеру и TTL словарь
+    в памяти процесса и, если shared, кэш Django. Общий кэш сбрасывается
+    сигналами во всех процессах сразу, поэтому с ним локальный слой не
+    используется.
+    """
+
+    def __init__(self, timeout, size, shared=False):
+        self.timeout = timeout
+        self.size = size
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+
+    @staticmethod
+    def cache_key(key):
+        return f'auth-token:{hashlib.sha1(key.encode()).hexdigest()}'
+
+    @staticmethod
+    def snapshot(token):
+        user = token.user
+        return (
+            token.created,
+            SNAPSHOT_FIELDS,
+            [getattr(user, name) for name in SNAPSHOT_FIELDS],
+        )
+
+    @staticmethod
+    def restore(key, snapshot):
+        created, field_names, values = snapshot
+        user = UserModel.from_db(DEFAULT_DB_ALIAS, field_names, values)
+        token = Token.from_db(
+            DEFAULT_DB_ALIAS, ('key', 'user_id', 'created'),
+            (key, user.pk, created),
+        )
+        token.user = user
+        return token
+
+    def get(self, key):
+        if self.shared:
+            snapshot = cache.get(self.cache_key(key))
+        else:
+            snapshot = self._get_local(key)
+        if snapshot is None:
+            return None
+        return self.restore(key, snapshot)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, _, snapshot = entry
+            if expires < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def set(self, key, token):
+        snapshot = self.snapshot(token)
+        if self.shared:
+            cache.set(self.cache_key(key), snapshot, self.timeout)
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (
+                time.monotonic() + self.timeout, token.user_id, snapshot
+            )
+            self._keys_by_user.setdefault(token.user_id, set()).add(key)
+            while len(self._entries) > self.size:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1]
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def invalidate(self, key):
+        if self.shared:
+            cache.delete(self.cache_key(key))
+            return
+        with self._lock:
+            self._discard(key)
+
+    def invalidate_user(self, user_id):
+        if self.shared:
+            cache.delete_many([
+                self.cache_key(key) for key in
+                Token.objects.filter(user_id=user_id).values_list(
+                    'key', flat=True
+                )
+            ])
+            return
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._discard(key)
+
+
+token_cache = TokenCache(
+    settings.AUTH_TOKEN_CACHE_TIMEOUT,
+    settings.AUTH_TOKEN_CACHE_SIZE,
+    settings.AUTH_TOKEN_CACHE_SHARED,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication, который не ходит в БД при попадании в кэш. """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is not None:
+            auth_cache_requests.inc(result='hit')
+            return token.user, token
+
+        auth_cache_requests.inc(result='miss')
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, token)
+        return user, token
@@ -0,0 +1,112 @@
+import bisect
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+
+from api.caches import ingredients_payload
+from recipes.models import Ingredient as IngredientModel
+
+logger = logging.getLogger(__name__)
+
+
+def fold(value):
+    """ Ключ сравнения: без регистра, «ё» равна «е». """
+    return value.casefold().replace('ё', 'е')
+
+
+class BackgroundIndex(ABC):
+    """ Индекс в памяти процесса, который можно прогреть в фоне. """
+    name = 'индекс'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._warming = False
+        self._state = None
+
+    @property
+    @abstractmethod
+    def ready(self):
+        """ Индекс собран и не устарел. """
+
+    @abstractmethod
+    def warm(self):
+        """ Собирает индекс, если он ещё не готов. """
+
+    def reset(self):
+        """ Сбрасывает индекс: следующее обращение соберёт его заново. """
+        with self._lock:
+            self._state = None
+
+    def warm_in_background(self):
+        if self.ready or self._warming:
+            return
+        self._warming = True
+        threading.Thread(target=self._warm_thread, daemon=True).start()
+
+    def _warm_thread(self):
+        try:
+            self.warm()
+        except Exception:
+            logger.exception('Не удалось загрузить %s', self.name)
+        finally:
+            self._warming = False
+            connection.close()
+
+
+class PrefixIndex(BackgroundIndex):
+    """
+    Отсортированный массив ключей ингредиентов для поиска по префиксу
+    двоичным поиском. Индекс помечен версией справочника из общего кэша:
+    после любой записи, в том числе из другого процесса или bulk_create,
+    он пересобирается в фоне, а поиск до этого идёт через БД. Состояние
+    заменяется целиком, поэтому чтение идёт без блокировки.
+    """
+    name = 'индекс ингредиентов'
+
+    def __init__(self, limit, version):
+        super().__init__()
+        self.limit = limit
+        self.version = version
+
+    @property
+    def ready(self):
+        state = self._state
+        return state is not None and state[0] == self.version.get()
+
+    def warm(self):
+        with self._lock:
+            if self.ready:
+                return
+            version = self.version.get()
+            rows = IngredientModel.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+            rows = {row[0]: row for row in rows}
+            keys = sorted(
+                (fold(name), pk) for pk, name, _ in rows.values()
+            )
+            self._state = (version, keys, rows)
+
+    def search(self, prefix):
+        prefix = fold(prefix)
+        _, keys, rows = self._state
+        result = []
+        position = bisect.bisect_left(keys, (prefix,))
+        while len(result) < self.limit and position < len(keys):
+            key, pk = keys[position]
+            if not key.startswith(prefix):
+                break
+            _, name, measurement_unit = rows[pk]
+            result.append({
+                'id': pk, 'name': name, 'measurement_unit': measurement_unit,
+            })
+            position += 1
+        return result
+
+
+ingredient_index = PrefixIndex(
+    settings.INGREDIENT_AUTOCOMPLETE_LIMIT, ingredients_payload.version
+)
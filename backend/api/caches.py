@@ -0,0 +1,202 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient as IngredientModel
+from recipes.models import ShoppingListItem as ShoppingListItemModel
+from recipes.models import Tag as TagModel
+
+
+class CacheVersion:
+    """
+    Номер версии в общем кэше: его видят все процессы, включая воркер.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        version = cache.get(self.key)
+        if version is not None:
+            return version
+
+        # После вытеснения ключа версия не должна повториться.
+        version = time.time_ns()
+        if cache.add(self.key, version, None):
+            return version
+        return cache.get(self.key, version)
+
+    def bump(self, **kwargs):
+        """ Новая версия. """
+        try:
+            return cache.incr(self.key)
+        except ValueError:
+            version = time.time_ns()
+            cache.set(self.key, version, None)
+            return version
+
+
+class PrecomputedPayload:
+    """
+    Готовое JSON-тело справочника, собранное в процессе. Пересобирается,
+    когда меняется его версия в общем кэше.
+    """
+
+    def __init__(self, prefix, queryset, serializer_class):
+        self.version = CacheVersion(f'{prefix}:version')
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self._lock = threading.Lock()
+        self._payload = None
+
+    def invalidate(self, **kwargs):
+        # До коммита параллельный запрос собрал бы новую версию из
+        # старых данных.
+        transaction.on_commit(self.version.bump)
+
+    def reset(self):
+        with self._lock:
+            self._payload = None
+
+    def get(self):
+        # Версия читается до выборки: если запись закоммитят во время
+        # сборки, следующий запрос увидит новую версию и пересоберёт.
+        version = self.version.get()
+        payload = self._payload
+        if payload is not None and payload[0] == version:
+            return payload[1:]
+
+        with self._lock:
+            if self._payload is None or self._payload[0] != version:
+                data = self.serializer_class(
+                    self.queryset.all(), many=True
+                ).data
+                body = JSONRenderer().render(data)
+                self._payload = (
+                    version,
+                    body,
+                    quote_etag(hashlib.sha1(body).hexdigest()),
+                    int(time.time()),
+                )
+            return self._payload[1:]
+
+    def response(self, request):
+        body, etag, last_modified = self.get()
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        )
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class VersionedResponseCache:
+    """
+    Кэш готовых ответов. Ключ включает номер версии: при любой записи
+    версия увеличивается, и все прежние ответы становятся недостижимыми.
+    """
+
+    def __init__(self, prefix, timeout):
+        self.prefix = prefix
+        self.timeout = timeout
+        self._version = CacheVersion(f'{prefix}:version')
+
+    def version(self):
+        return self._version.get()
+
+    def bump(self, **kwargs):
+        self._version.bump()
+
+    def key(self, request, variant):
+        query = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+        )
+        raw = f'{request.get_host()}{request.path}|{query}|{variant}'
+        digest = hashlib.sha1(raw.encode()).hexdigest()
+        return f'{self.prefix}:{self.version()}:{digest}'
+
+    def get(self, key):
+        cached = cache.get(key)
+        if cached is None:
+            return None
+
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+
+    def set(self, key, response):
+        self.store(key, response.content, response['Content-Type'])
+
+    def store(self, key, content, content_type):
+        cache.set(key, (content, content_type), self.timeout)
+
+
+class ShoppingListCache(VersionedResponseCache):
+    """
+    Готовые файлы списка покупок. Ключ - отпечаток итогов: их число и
+    наибольший id. Пересчёт итогов удаляет строки и вставляет новые,
+    так что любая правка корзины или рецепта даёт новый ключ, и старые
+    файлы просто истекают по таймауту. Версия увеличивается при
+    изменении справочника ингредиентов.
+    """
+
+    def __init__(self, prefix, timeout, max_size):
+        super().__init__(prefix, timeout)
+        self.max_size = max_size
+
+    def fingerprint(self, user):
+        items = ShoppingListItemModel.objects.filter(user=user).aggregate(
+            count=Count('pk'), last=Max('pk'),
+        )
+        raw = f'{self.version()}|{items["count"]}:{items["last"]}'
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def file_key(self, fingerprint, file_format):
+        return f'{self.prefix}:{fingerprint}:{file_format}'
+
+    def stream(self, key, chunks, content_type, charset):
+        """
+        Отдаёт chunks и кэширует файл, если его дочитали до конца.
+        Файл больше max_size не копится в памяти и не кэшируется.
+        """
+        body = []
+        size = 0
+        for chunk in chunks:
+            yield chunk
+            if body is None:
+                continue
+            data = chunk.encode(charset)
+            size += len(data)
+            if size > self.max_size:
+                body = None
+            else:
+                body.append(data)
+        if body is not None:
+            self.store(key, b''.join(body), content_type)
+
+
+tags_payload = PrecomputedPayload(
+    'tags', TagModel.objects.all(), TagSerializer
+)
+ingredients_payload = PrecomputedPayload(
+    'ingredients', IngredientModel.objects.all(), IngredientSerializer
+)
+recipes_cache = VersionedResponseCache(
+    'recipes', settings.RECIPES_CACHE_TIMEOUT
+)
+shopping_list_cache = ShoppingListCache(
+    'shopping-list', settings.SHOPPING_LIST_CACHE_TIMEOUT,
+    settings.SHOPPING_LIST_CACHE_MAX_SIZE,
+)
@@ -0,0 +1,155 @@
+import numpy as np
+
+from api.autocomplete import BackgroundIndex
+from api.caches import CacheVersion
+from recipes.models import IngredientRecipe as IngredientRecipeModel
+
+ID_DTYPE = np.int64
+POSITION_DTYPE = np.int32
+
+
+class IngredientRecipeIndex(BackgroundIndex):
+    """
+    Инвертированный индекс «ингредиент -> рецепты». У каждого рецепта есть
+    позиция в массивах recipe_ids и sizes (число ингредиентов рецепта),
+    у ингредиента - отсортированный массив позиций его рецептов.
+    Массивы не меняются на месте: запись создаёт новые, поэтому чтение
+    идёт без блокировки.
+
+    Индекс помечен версией из общего кэша, каждая запись поднимает её.
+    Если версия выросла только на свою запись, индекс правится на месте,
+    иначе (писал другой процесс) - пересобирается при следующем поиске.
+    """
+    name = 'индекс ингредиентов рецептов'
+
+    def __init__(self, version):
+        super().__init__()
+        self.version = version
+
+    @property
+    def ready(self):
+        state = self._state
+        return state is not None and state[0] == self.version.get()
+
+    def warm(self):
+        with self._lock:
+            if self.ready:
+                return
+            version = self.version.get()
+            links = np.array(
+                list(IngredientRecipeModel.objects.values_list(
+                    'recipe_id', 'ingredient_id'
+                )),
+                dtype=ID_DTYPE,
+            ).reshape(-1, 2)
+            self._state = (version,) + self._build(links)
+
+    @staticmethod
+    def _build(links):
+        recipe_ids, positions = np.unique(links[:, 0], return_inverse=True)
+        positions = positions.astype(POSITION_DTYPE)
+        sizes = np.bincount(positions, minlength=len(recipe_ids))
+        order = np.lexsort((positions, links[:, 1]))
+        ingredients = links[order, 1]
+        positions = positions[order]
+        bounds = np.flatnonzero(np.diff(ingredients)) + 1
+        postings = {
+            int(ingredient): chunk
+            for ingredient, chunk in zip(
+                ingredients[np.r_[0, bounds]] if len(ingredients) else (),
+                np.split(positions, bounds),
+            )
+        }
+        recipe_positions = {
+            int(recipe_id): position
+            for position, recipe_id in enumerate(recipe_ids)
+        }
+        return recipe_ids, sizes, postings, recipe_positions
+
+    def refresh_recipe(self, recipe_id):
+        """
+        Вызывается после коммита записи: поднимает версию и перечитывает
+        ингредиенты рецепта, удалённый рецепт убирается. Блокировка та же,
+        что у warm(): запись во время прогрева дождётся его и применится
+        к только что собранному индексу.
+        """
+        version = self.version.bump()
+        with self._lock:
+            state = self._state
+            if state is None or state[0] != version - 1:
+                return
+            ingredient_ids = set(IngredientRecipeModel.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', flat=True))
+            self._state = (version,) + self._replace(
+                state[1:], recipe_id, ingredient_ids
+            )
+
+    @staticmethod
+    def _replace(state, recipe_id, ingredient_ids):
+        recipe_ids, sizes, postings, recipe_positions = state
+        postings = dict(postings)
+        position = recipe_positions.get(recipe_id)
+        if position is None:
+            if not ingredient_ids:
+                return state
+            position = len(recipe_ids)
+            recipe_ids = np.append(recipe_ids, ID_DTYPE(recipe_id))
+            sizes = np.append(sizes, 0)
+            recipe_positions = dict(recipe_positions)
+            recipe_positions[recipe_id] = position
+        else:
+            for ingredient_id, chunk in postings.items():
+                index = np.searchsorted(chunk, position)
+                if index < len(chunk) and chunk[index] == position:
+                    postings[ingredient_id] = np.delete(chunk, index)
+
+        for ingredient_id in ingredient_ids:
+            chunk = postings.get(ingredient_id, np.empty(0, POSITION_DTYPE))
+            index = np.searchsorted(chunk, position)
+            postings[ingredient_id] = np.insert(chunk, index, position)
+
+        sizes = sizes.copy()
+        sizes[position] = len(ingredient_ids)
+        return recipe_ids, sizes, postings, recipe_positions
+
+    def search(self, ingredient_ids, max_missing=None):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов, по убыванию
+        доли имеющихся ингредиентов: [(id, совпало, не хватает, доля)].
+        """
+        if not self.ready:
+            self.warm()
+        _, recipe_ids, sizes, postings, _ = self._state
+        chunks = [
+            postings[pk] for pk in set(ingredient_ids) if pk in postings
+        ]
+        if not chunks:
+            return []
+
+        matched = np.bincount(
+            np.concatenate(chunks), minlength=len(recipe_ids)
+        )
+        candidates = np.flatnonzero(matched)
+        matched = matched[candidates]
+        missing = sizes[candidates] - matched
+        if max_missing is not None:
+            keep = missing <= max_missing
+            candidates, matched, missing = (
+                candidates[keep], matched[keep], missing[keep]
+            )
+
+        coverage = matched / sizes[candidates]
+        ids = recipe_ids[candidates]
+        order = np.lexsort((-ids, -matched, missing, -coverage))
+        return [
+            (int(pk), int(hit), int(miss), float(share))
+            for pk, hit, miss, share in zip(
+                ids[order], matched[order], missing[order], coverage[order]
+            )
+        ]
+
+
+ingredient_recipe_index = IngredientRecipeIndex(
+    CacheVersion('cookable:version')
+)
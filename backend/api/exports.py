@@ -0,0 +1,78 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from rest_framework.renderers import BaseRenderer
+
+from recipes.models import ShoppingListItem as ShoppingListItemModel
+
+
+def shopping_cart_rows(user, chunk_size=500):
+    """ Итоги ингредиентов из корзины пользователя, по мере выборки. """
+    items = ShoppingListItemModel.objects.filter(user=user).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'total',
+    ).order_by('-total', 'ingredient__name')
+    return items.iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    """ Файлоподобный объект для csv.writer: возвращает записанную строку. """
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(BaseRenderer, ABC):
+    """
+    Рендерер списка покупок. Сам ответ отдаётся потоком через stream(),
+    а render() нужен DRF для тела ошибок (401 и т.п.).
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    @abstractmethod
+    def stream(self, rows):
+        """ Части ответа по строкам shopping_cart_rows(). """
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        for name, units, total in rows:
+            yield f'{name} ({units}) - {total}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, rows):
+        separator = '['
+        for name, units, total in rows:
+            yield separator + json.dumps({
+                'name': name, 'measurement_unit': units, 'amount': total,
+            }, ensure_ascii=False)
+            separator = ',\n'
+        yield '[]' if separator == '[' else ']'
+
+
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+)
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import transaction
+
+from api.paginations import FeedPagination
+from jobs.queue import cancel, task
+from recipes.models import FeedItem as FeedItemModel
+from recipes.models import Recipe as RecipeModel
+from users.models import Follow as FollowModel
+
+BATCH_SIZE = 1000
+
+
+def fan_out_enabled():
+    return settings.FEED_STRATEGY == 'fanout'
+
+
+def backfill_key(user_id, author_id):
+    return f'feed-backfill:{user_id}:{author_id}'
+
+
+def feed_queryset(user):
+    """ Рецепты авторов, на которых подписан user, по выбранной стратегии. """
+    if fan_out_enabled():
+        return RecipeModel.objects.filter(feed_items__user=user)
+    return RecipeModel.objects.filter(
+        author__in=FollowModel.objects.filter(user=user).values('author')
+    )
+
+
+def fan_out_page(user, request):
+    """
+    Страница ленты при fanout: записи выбираются по индексу
+    (user, -pub_date, recipe) без соединения с рецептами, затем
+    рецепты догружаются по id в том же порядке.
+    """
+    paginator = FeedPagination()
+    items = paginator.paginate_queryset(
+        FeedItemModel.objects.filter(user=user).only('recipe', 'pub_date'),
+        request,
+    )
+    recipes = RecipeModel.objects.with_related().in_bulk(
+        [item.recipe_id for item in items]
+    )
+    page = [
+        recipes[item.recipe_id] for item in items
+        if item.recipe_id in recipes
+    ]
+    return paginator, page
+
+
+@task
+def fan_out_recipe(recipe_id):
+    """
+    Добавляет рецепт в ленты всех подписчиков автора. Подписки каждой
+    пачки заблокированы до коммита вставки: отписка дождётся его, и trim
+    уберёт уже вставленные записи.
+    """
+    recipe = RecipeModel.objects.filter(pk=recipe_id).only(
+        'author', 'pub_date'
+    ).first()
+    if recipe is None or recipe.author_id is None:
+        return
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            follows = list(FollowModel.objects.select_for_update().filter(
+                author_id=recipe.author_id, pk__gt=last_pk,
+            ).order_by('pk').values_list('pk', 'user_id')[:BATCH_SIZE])
+            FeedItemModel.objects.bulk_create(
+                [
+                    FeedItemModel(
+                        user_id=user_id, recipe_id=recipe_id,
+                        author_id=recipe.author_id, pub_date=recipe.pub_date,
+                    )
+                    for _, user_id in follows
+                ],
+                ignore_conflicts=True,
+            )
+        if len(follows) < BATCH_SIZE:
+            return
+        last_pk = follows[-1][0]
+
+
+@task
+def backfill(user_id, author_id):
+    """
+    Последние рецепты автора в ленту подписчика, если подписка ещё есть:
+    после отписки задача могла остаться в очереди или уже выполняться.
+    """
+    recipes = RecipeModel.objects.filter(
+        author_id=author_id
+    ).order_by('-pub_date', 'id').values_list('id', 'pub_date')[
+        :settings.FEED_BACKFILL_LIMIT
+    ]
+    with transaction.atomic():
+        follow = FollowModel.objects.select_for_update().filter(
+            user_id=user_id, author_id=author_id
+        ).values_list('pk', flat=True).first()
+        if follow is None:
+            return
+        FeedItemModel.objects.bulk_create(
+            (
+                FeedItemModel(
+                    user_id=user_id, recipe_id=recipe_id,
+                    author_id=author_id, pub_date=pub_date,
+                )
+                for recipe_id, pub_date in recipes
+            ),
+            batch_size=BATCH_SIZE, ignore_conflicts=True,
+        )
+
+
+def trim(user_id, author_id):
+    """ Убирает рецепты автора из ленты после отписки. """
+    cancel(backfill_key(user_id, author_id))
+    FeedItemModel.objects.filter(user_id=user_id, author_id=author_id).delete()
@@ -1,7 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, F, OuterRef, Q
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Ingredient, Recipe, Tag
+from api.search import search_recipes
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingСart, Tag,
+                            TagRecipe)
 
 User = get_user_model()
 
@@ -23,6 +27,7 @@ class RecipeFilter(FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(
         method="filter_is_favorited",
@@ -30,17 +35,83 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart',
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'tags', 'is_favorited', 'is_in_shopping_cart', 'search'
+        )
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тегов: проверка битовой маски без JOIN,
+        для тегов вне маски - подзапрос EXISTS по TagRecipe.
+        """
+        if not value:
+            return queryset
+
+        mask = 0
+        unmasked = []
+        for tag in value:
+            if tag.mask:
+                mask |= tag.mask
+            else:
+                unmasked.append(tag.pk)
+
+        condition = Q()
+        if mask:
+            queryset = queryset.alias(
+                tags_match=F('tags_mask').bitand(mask)
+            )
+            condition |= Q(tags_match__gt=0)
+        if unmasked:
+            condition |= Q(Exists(TagRecipe.objects.filter(
+                recipe=OuterRef('pk'), tag__in=unmasked,
+            )))
+        return queryset.filter(condition)
+
+    def filter_search(self, queryset, name, value):
+        """ Полнотекстовый поиск по названию, описанию и ингредиентам. """
+        return search_recipes(queryset, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.filter(Exists(ShoppingСart.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'),
+            )))
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorite__user=self.request.user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'),
+            )))
         return queryset
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    ?ordering=-favorites_count и т.п. Порядок дополняется (-pub_date, id),
+    чтобы при равных значениях страницы не перемешивались.
+    При ?search= без ?ordering= рецепты сортируются по релевантности,
+    если её посчитал RecipeFilter (в ленте поиска нет).
+    """
+    tie_breakers = ('-pub_date', 'id')
+
+    def get_ordering(self, request, queryset, view):
+        if (
+            'search_rank' in queryset.query.annotations
+            and not request.query_params.get(self.ordering_param)
+        ):
+            return ('-search_rank',) + self.tie_breakers
+
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+
+        fields = {field.lstrip('-') for field in ordering}
+        return tuple(ordering) + tuple(
+            field for field in self.tie_breakers
+            if field.lstrip('-') not in fields
+        )
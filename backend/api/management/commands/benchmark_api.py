@@ -0,0 +1,353 @@
+import io
+import itertools
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.autocomplete import ingredient_index
+from api.caches import ingredients_payload, tags_payload
+from api.cookable import ingredient_recipe_index
+from api.feed import fan_out_enabled
+from api.search import recipe_search_index
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingСart, Tag, TagRecipe)
+from users.models import Follow, User
+
+INGREDIENTS_PATH = Path(settings.BASE_DIR).parent / 'data/ingredients.json'
+TAGS = (
+    {'name': 'Завтрак', 'color': '#00ff7f', 'slug': 'breakfast'},
+    {'name': 'Обед', 'color': '#f754e1', 'slug': 'lunch'},
+    {'name': 'Ужин', 'color': '#00bfff', 'slug': 'dinner'},
+)
+
+# Допустимое число SQL-запросов на один вызов эндпоинта с пустым кэшем.
+# Авторизованный запрос с холодным кэшем токенов ещё читает токен.
+QUERY_BUDGETS = {
+    'recipes-list': 10,
+    'recipes-detail': 7,
+    'recipes-cookable': 8,
+    'recipes-similar': 2,
+    # При fanout: страница FeedItem и рецепты по id - на запрос больше.
+    'recipes-feed': 8,
+    'recipes-favorite': 6,
+    # После коммита пересчитываются итоги списка покупок.
+    'recipes-shopping-cart': 11,
+    'recipes-favorite-bulk': 8,
+    'recipes-shopping-cart-bulk': 14,
+    'recipes-shopping-cart-totals': 2,
+    'recipes-download-shopping-cart': 3,
+    'users-list': 6,
+    'users-subscriptions': 4,
+    # При fanout подписка ещё ставит задачу заполнения ленты.
+    'users-subscribe': 10,
+    'ingredients-list': 1,
+    'tags-list': 1,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон API на синтетических данных: число запросов '
+        'к БД, время ответа и размер тела для каждого эндпоинта.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок на одного пользователя.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--report', default='bench_report.json')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+        )
+        try:
+            self.random = random.Random(options['seed'])
+            # Задачи только ставятся в очередь, как при работе с воркером:
+            # бюджеты считают запросы самого API.
+            with override_settings(JOBS_INLINE=False):
+                self.seed(options)
+                results = self.run_benchmarks(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'dataset': {
+                key: options[key] for key in ('users', 'recipes', 'follows')
+            },
+            'results': results,
+        }
+        with open(options['report'], 'w', encoding='UTF-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+        failures = [item for item in results if item['failures']]
+        for item in results:
+            style = self.style.ERROR if item['failures'] else str
+            self.stdout.write(style(
+                f"{item['endpoint']:32} {item['method']:6} "
+                f"{item['queries']:>3}/{item['budget']:<3} "
+                f"тёплый {item['queries_warm']:>3} "
+                f"{item['time_ms']:>8.1f} ms {item['bytes']:>8} B  "
+                f"{item['url']}"
+            ))
+        if failures:
+            raise CommandError(
+                f'Превышен бюджет или неверный статус: {len(failures)} '
+                f'из {len(results)}. Отчёт: {options["report"]}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Бюджеты соблюдены. Отчёт: {options["report"]}'
+        ))
+
+    def seed(self, options):
+        rnd = self.random
+        password = make_password('benchmark')
+        User.objects.bulk_create(
+            User(
+                username=f'user_{index}', email=f'user{index}@example.com',
+                first_name='Имя', last_name='Фамилия', password=password,
+            )
+            for index in range(options['users'])
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        Token.objects.bulk_create(
+            Token(key=f'{user_id:040d}', user_id=user_id)
+            for user_id in user_ids
+        )
+        follows = set()
+        follows_per_user = min(options['follows'], len(user_ids))
+        for user_id in user_ids:
+            for author_id in rnd.sample(user_ids, follows_per_user):
+                if author_id != user_id:
+                    follows.add((user_id, author_id))
+        Follow.objects.bulk_create(
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in follows
+        )
+
+        with open(INGREDIENTS_PATH, encoding='UTF-8') as file:
+            Ingredient.objects.bulk_create(
+                Ingredient(**item) for item in json.load(file)
+            )
+        Tag.objects.bulk_create(Tag(**tag) for tag in TAGS)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+        authors = rnd.sample(user_ids, max(1, len(user_ids) // 4))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author_id=rnd.choice(authors), name=f'Рецепт {index}',
+                text='Описание рецепта', cooking_time=rnd.randint(1, 120),
+                image='recipes/image/benchmark.png',
+            )
+            for index in range(options['recipes'])
+        )
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe_id=recipe_id, ingredient_id=ingredient_id,
+                amount=rnd.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rnd.sample(ingredient_ids, rnd.randint(3, 12))
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rnd.sample(tag_ids, rnd.randint(1, len(tag_ids)))
+        )
+        Recipe.objects.all().update_tags_mask()
+        for model in (Favorite, ShoppingСart):
+            model.objects.bulk_create(
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in rnd.sample(recipe_ids, rnd.randint(0, 10))
+            )
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        call_command('reconcile_counters', stdout=io.StringIO())
+        call_command('update_search_vectors', stdout=io.StringIO())
+        call_command('build_similar_recipes', stdout=io.StringIO())
+        if fan_out_enabled():
+            call_command('rebuild_feeds', stdout=io.StringIO())
+
+        self.user = User.objects.get(pk=user_ids[0])
+        self.author = Follow.objects.filter(user=self.user).first().author
+        self.stranger = (
+            User.objects.exclude(following__user=self.user)
+            .exclude(pk=self.user.pk).first()
+        )
+        self.recipe_id = self.random.choice(recipe_ids)
+        self.pantry = self.random.sample(ingredient_ids, 30)
+        free_recipe_ids = list(Recipe.objects.exclude(
+            favorite__user=self.user
+        ).exclude(shopping_cart__user=self.user).values_list(
+            'pk', flat=True
+        )[:31])
+        self.free_recipe_id = free_recipe_ids[0]
+        self.bulk_recipe_ids = free_recipe_ids[1:]
+
+    def scenarios(self):
+        author = self.author.pk
+        tag_filters = [
+            ''.join(f'&tags={slug}' for slug in combo)
+            for size in range(len(TAGS) + 1)
+            for combo in itertools.combinations(
+                [tag['slug'] for tag in TAGS], size
+            )
+        ]
+        for tags, favorited, in_cart, by_author in itertools.product(
+            tag_filters, ('', '&is_favorited=1'),
+            ('', '&is_in_shopping_cart=1'), ('', f'&author={author}'),
+        ):
+            query = f'{tags}{favorited}{in_cart}{by_author}'.lstrip('&')
+            yield 'recipes-list', 'get', f'/api/recipes/?{query}', True
+        yield 'recipes-list', 'get', '/api/recipes/?limit=50', True
+        yield 'recipes-list', 'get', '/api/recipes/?page=3', False
+        yield 'recipes-list', 'get', '/api/recipes/?pagination=cursor', False
+        yield (
+            'recipes-list', 'get', '/api/recipes/?ordering=-favorites_count',
+            False,
+        )
+        yield 'recipes-list', 'get', '/api/recipes/?search=рецепт', True
+        yield 'recipes-detail', 'get', f'/api/recipes/{self.recipe_id}/', True
+        yield 'recipes-detail', 'get', f'/api/recipes/{self.recipe_id}/', False
+        yield 'recipes-feed', 'get', '/api/recipes/feed/', True
+        yield 'recipes-similar', 'get', (
+            f'/api/recipes/{self.recipe_id}/similar/'
+        ), True
+        pantry = ','.join(map(str, self.pantry))
+        yield 'recipes-cookable', 'get', (
+            f'/api/recipes/cookable/?ingredients={pantry}'
+        ), True
+        yield 'recipes-cookable', 'get', (
+            f'/api/recipes/cookable/?ingredients={pantry}&max_missing=3'
+        ), False
+
+        for action in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{self.free_recipe_id}/{action}/'
+            name = f'recipes-{action.replace("_", "-")}'
+            yield name, 'post', url, True
+            yield name, 'delete', url, True
+            payload = {'recipes': self.bulk_recipe_ids}
+            url = f'/api/recipes/{action}/'
+            yield f'{name}-bulk', 'post', url, True, payload
+            yield f'{name}-bulk', 'delete', url, True, payload
+        yield (
+            'recipes-shopping-cart-totals', 'get',
+            '/api/recipes/shopping_cart/totals/', True,
+        )
+        for export_format in ('txt', 'csv', 'json'):
+            yield (
+                'recipes-download-shopping-cart', 'get',
+                f'/api/recipes/download_shopping_cart/?format={export_format}',
+                True,
+            )
+
+        yield 'users-list', 'get', '/api/users/', True
+        for limit in ('', '?recipes_limit=3', '?pagination=cursor'):
+            yield (
+                'users-subscriptions', 'get',
+                f'/api/users/subscriptions/{limit}', True,
+            )
+        url = f'/api/users/{self.stranger.pk}/subscribe/?recipes_limit=3'
+        yield 'users-subscribe', 'post', url, True
+        yield 'users-subscribe', 'delete', url, True
+
+        yield 'ingredients-list', 'get', '/api/ingredients/', False
+        for prefix in ('', 'а', 'мол', 'сыр'):
+            yield (
+                'ingredients-list', 'get',
+                f'/api/ingredients/?name={prefix}', False,
+            )
+        yield 'tags-list', 'get', '/api/tags/', False
+
+    def call(self, client, method, url, payload=None):
+        options = {}
+        if payload is not None:
+            options = {'data': payload, 'content_type': 'application/json'}
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, **options)
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, len(context.captured_queries), (
+            elapsed, size
+        )
+
+    @staticmethod
+    def reset_caches():
+        """ Общий кэш и всё, что процесс держит в памяти между запросами. """
+        cache.clear()
+        tags_payload.reset()
+        ingredients_payload.reset()
+        ingredient_index.reset()
+        ingredient_recipe_index.reset()
+        recipe_search_index.invalidate()
+        token_cache.clear()
+
+    def run_benchmarks(self, repeat):
+        """
+        Первый прогон каждого сценария идёт с пустым кэшем: бюджет
+        сравнивается с ним, тёплые прогоны только попадают в отчёт.
+        """
+        token = Token.objects.get(user=self.user).key
+        user_client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+        anonymous_client = Client()
+        results = []
+        for name, method, url, authorized, *payload in self.scenarios():
+            client = user_client if authorized else anonymous_client
+            runs = 1 if method != 'get' else repeat
+            timings = []
+            counts = []
+            self.reset_caches()
+            for _ in range(runs):
+                status_code, queries, (elapsed, size) = self.call(
+                    client, method, url, *payload
+                )
+                timings.append(elapsed)
+                counts.append(queries)
+            budget = QUERY_BUDGETS[name]
+            failures = []
+            if max(counts) > budget:
+                failures.append('queries')
+            if status_code >= 400:
+                failures.append('status')
+            results.append({
+                'endpoint': name,
+                'method': method.upper(),
+                'url': url,
+                'authorized': authorized,
+                'status': status_code,
+                'queries': counts[0],
+                'queries_warm': counts[-1],
+                'budget': budget,
+                'time_ms': statistics.median(timings) * 1000,
+                'time_max_ms': max(timings) * 1000,
+                'bytes': size,
+                'failures': failures,
+            })
+        return results
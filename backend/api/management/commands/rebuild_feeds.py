@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.feed import backfill
+from recipes.models import FeedItem
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает ленты подписок (FeedItem) по всем подпискам. Нужна '
+        'при переключении FEED_STRATEGY на fanout.'
+    )
+
+    def handle(self, *args, **options):
+        follows = Follow.objects.values_list('user_id', 'author_id')
+        with transaction.atomic():
+            FeedItem.objects.all().delete()
+            for user_id, author_id in follows.iterator():
+                backfill(user_id, author_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересобраны: {FeedItem.objects.count()} записей'
+        ))
@@ -0,0 +1,112 @@
+import bisect
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from recipes.models import Favorite as FavoriteModel
+from recipes.models import ShoppingСart as ShoppingСartModel
+from users.models import Follow as FollowModel
+
+
+class Memberships:
+    """ Отсортированные массивы id: избранное, корзина, подписки. """
+
+    def __init__(self, favorites=(), cart=(), follows=()):
+        self.favorites = array('q', favorites)
+        self.cart = array('q', cart)
+        self.follows = array('q', follows)
+
+    @staticmethod
+    def _contains(ids, pk):
+        position = bisect.bisect_left(ids, pk)
+        return position < len(ids) and ids[position] == pk
+
+    def is_favorited(self, recipe_id):
+        return self._contains(self.favorites, recipe_id)
+
+    def is_in_shopping_cart(self, recipe_id):
+        return self._contains(self.cart, recipe_id)
+
+    def is_subscribed(self, author_id):
+        return self._contains(self.follows, author_id)
+
+
+EMPTY = Memberships()
+
+
+class MembershipCache:
+    """
+    Членство пользователя в кэше Django под ключом с номером версии.
+    Запись в избранное, корзину или подписки увеличивает версию сразу и
+    ещё раз после коммита, поэтому снимок, прочитанный до коммита,
+    становится недостижимым.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    @staticmethod
+    def version_key(user_id):
+        return f'memberships:{user_id}:version'
+
+    def version(self, user_id):
+        key = self.version_key(user_id)
+        version = cache.get(key)
+        if version is not None:
+            return version
+
+        version = time.time_ns()
+        if cache.add(key, version, None):
+            return version
+        return cache.get(key, version)
+
+    def _bump(self, user_id):
+        try:
+            cache.incr(self.version_key(user_id))
+        except ValueError:
+            cache.set(self.version_key(user_id), time.time_ns(), None)
+
+    def invalidate(self, user_id):
+        self._bump(user_id)
+        transaction.on_commit(lambda: self._bump(user_id))
+
+    @staticmethod
+    def load(user_id):
+        return Memberships(
+            sorted(FavoriteModel.objects.filter(
+                user_id=user_id
+            ).values_list('recipe_id', flat=True)),
+            sorted(ShoppingСartModel.objects.filter(
+                user_id=user_id
+            ).values_list('recipe_id', flat=True)),
+            sorted(FollowModel.objects.filter(
+                user_id=user_id
+            ).values_list('author_id', flat=True)),
+        )
+
+    def get(self, user_id):
+        key = f'memberships:{user_id}:{self.version(user_id)}'
+        memberships = cache.get(key)
+        if memberships is None:
+            memberships = self.load(user_id)
+            # Внутри транзакции видны ещё не закоммиченные строки.
+            if not connection.in_atomic_block:
+                cache.set(key, memberships, self.timeout)
+        return memberships
+
+    def for_request(self, request):
+        """ Членство текущего пользователя, один раз на запрос. """
+        if request is None or request.user.is_anonymous:
+            return EMPTY
+
+        memberships = getattr(request, '_memberships', None)
+        if memberships is None:
+            memberships = self.get(request.user.pk)
+            request._memberships = memberships
+        return memberships
+
+
+membership_cache = MembershipCache(settings.MEMBERSHIP_CACHE_TIMEOUT)
@@ -0,0 +1,190 @@
+import bisect
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+def format_value(value):
+    if isinstance(value, float) and value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """ Метрика с набором меток; значения хранятся в памяти процесса. """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self):
+        """ Строки экспозиции: [(имя, метки, значение)]. """
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        for name, labels, value in self.samples():
+            lines.append(
+                f'{name}{format_labels(labels)} {format_value(value)}'
+            )
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, key, value) for key, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def replace(self, values):
+        """ Заменяет все значения: {кортеж значений меток: значение}. """
+        with self._lock:
+            self._values = defaultdict(float, {
+                tuple(zip(self.labelnames, key)): value
+                for key, value in values.items()
+            })
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0
+                ]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._series.items()
+            )
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(
+                self.buckets + (float('inf'),), counts
+            ):
+                cumulative += bucket_count
+                samples.append((
+                    f'{self.name}_bucket',
+                    key + (('le', format_value(float(bound))),),
+                    cumulative,
+                ))
+            samples.append((f'{self.name}_sum', key, total))
+            samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса. Каждый процесс gunicorn ведёт свой реестр,
+    поэтому значения нужно суммировать по процессам.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DURATION_BUCKETS):
+        return self._register(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def collector(self, func):
+        """ Функция, которая обновляет метрики перед каждой выдачей. """
+        with self._lock:
+            if func not in self._collectors:
+                self._collectors.append(func)
+        return func
+
+    def render(self):
+        for collect in list(self._collectors):
+            try:
+                collect()
+            except Exception:
+                logger.exception('Ошибка сбора метрик %s', collect.__name__)
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return '\n'.join(metric.render() for _, metric in metrics) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,105 @@
+import time
+
+from django.db import connection
+
+from api.metrics import QUERY_BUCKETS, registry
+
+LABELS = ('route', 'method', 'status')
+
+request_duration = registry.histogram(
+    'foodgram_request_duration_seconds',
+    'Полное время обработки запроса.', LABELS,
+)
+view_duration = registry.histogram(
+    'foodgram_view_duration_seconds',
+    'Время работы view без отрисовки ответа.', LABELS,
+)
+render_duration = registry.histogram(
+    'foodgram_render_duration_seconds',
+    'Время отрисовки ответа DRF.', LABELS,
+)
+db_duration = registry.histogram(
+    'foodgram_db_duration_seconds',
+    'Суммарное время SQL-запросов.', LABELS,
+)
+db_queries = registry.histogram(
+    'foodgram_db_queries',
+    'Количество SQL-запросов.', LABELS, buckets=QUERY_BUCKETS,
+)
+
+
+class QueryTimer:
+    """ Обёртка для connection.execute_wrapper: считает запросы и время. """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Замеряет SQL, работу view и отрисовку ответа, отдаёт их в заголовке
+    Server-Timing и копит гистограммы по маршрутам.
+    Запросы, выполненные при стриминге тела ответа, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        request._metrics = {}
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        marks = request._metrics
+        view_started = marks.get('view_started', start)
+        view_finished = marks.get('view_finished', finished)
+        timings = {
+            'db': timer.duration,
+            'view': view_finished - view_started,
+            'render': finished - view_finished,
+            'total': finished - start,
+        }
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={value * 1000:.1f}'
+            for name, value in timings.items()
+        ) + f', queries;desc="{timer.count}"'
+        self.observe(request, response, timer, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        request._metrics['view_finished'] = time.perf_counter()
+        return response
+
+    @staticmethod
+    def route(request):
+        match = request.resolver_match
+        if match is None:
+            return 'unmatched'
+        return match.url_name or match.route
+
+    def observe(self, request, response, timer, timings):
+        labels = {
+            'route': self.route(request),
+            'method': request.method,
+            'status': response.status_code,
+        }
+        request_duration.observe(timings['total'], **labels)
+        view_duration.observe(timings['view'], **labels)
+        render_duration.observe(timings['render'], **labels)
+        db_duration.observe(timer.duration, **labels)
+        db_queries.observe(timer.count, **labels)
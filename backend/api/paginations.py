@@ -1,6 +1,58 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
-class CustomPagination(PageNumberPagination):
+class KeysetPagination(CursorPagination):
     page_size = 6
     page_size_query_param = 'limit'
+    ordering = ('-pub_date', 'id')
+
+
+class FeedPagination(KeysetPagination):
+    """ Курсор по записям FeedItem в том же порядке, что и по рецептам. """
+    ordering = ('-pub_date', 'recipe_id')
+
+
+class PagePagination(PageNumberPagination):
+    """ Только по номеру страницы: подходит и для готовых списков. """
+    page_size = 6
+    page_size_query_param = 'limit'
+
+
+class CustomPagination(PagePagination):
+    """
+    Постраничная навигация по номеру страницы. С ?cursor=, ?pagination=cursor
+    или заголовком X-Pagination: cursor переключается на курсоры (keyset):
+    без COUNT(*) и OFFSET, ответ вида {next, previous, results}.
+    Курсор всегда идёт по cursor_ordering: ?ordering= и релевантность поиска
+    в этом режиме не действуют - по изменяемым и неуникальным полям
+    страницы пропускали бы и повторяли строки.
+    """
+    cursor_ordering = ('-pub_date', 'id')
+
+    def __init__(self):
+        self.keyset = None
+
+    @staticmethod
+    def wants_cursor(request):
+        return (
+            KeysetPagination.cursor_query_param in request.query_params
+            or request.query_params.get('pagination') == 'cursor'
+            or request.headers.get('X-Pagination') == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.wants_cursor(request):
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = KeysetPagination()
+        self.keyset.ordering = self.cursor_ordering
+        return self.keyset.paginate_queryset(queryset, request)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class UserPagination(CustomPagination):
+    cursor_ordering = ('username',)
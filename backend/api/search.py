@@ -0,0 +1,155 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, F, FloatField, Func, Value, When
+
+from api.autocomplete import fold
+from api.caches import CacheVersion
+from recipes.models import SEARCH_CONFIG
+from recipes.models import IngredientRecipe as IngredientRecipeModel
+from recipes.models import Recipe as RecipeModel
+
+WORD_RE = re.compile(r'\w{2,}')
+
+# Веса как у ts_rank по умолчанию: A - 1.0, B - 0.4, C - 0.2.
+WEIGHT_NAME = 1.0
+WEIGHT_INGREDIENT = 0.4
+WEIGHT_TEXT = 0.2
+
+
+def tokenize(value):
+    return WORD_RE.findall(fold(value))
+
+
+def stem(word):
+    """ Грубая замена стеммингу: отбрасывает окончание слова. """
+    if len(word) <= 4:
+        return word
+    return word[:max(4, len(word) - 2)]
+
+
+class RecipeSearchIndex:
+    """
+    Инвертированный индекс рецептов в памяти для СУБД без полнотекстового
+    поиска (локально на SQLite). Строится при первом поиске и помечен
+    версией из общего кэша: после записи в любом процессе версия растёт,
+    и каждый процесс при следующем поиске собирает индекс заново.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self._lock = threading.Lock()
+        self._index = None
+
+    def invalidate(self, **kwargs):
+        self.version.bump()
+
+    def build(self):
+        postings = defaultdict(dict)
+
+        def add(recipe_id, value, weight):
+            for token in tokenize(value):
+                scores = postings[token]
+                scores[recipe_id] = max(scores.get(recipe_id, 0), weight)
+
+        for pk, name, text in RecipeModel.objects.values_list(
+            'id', 'name', 'text'
+        ):
+            add(pk, name, WEIGHT_NAME)
+            add(pk, text, WEIGHT_TEXT)
+        for pk, name in IngredientRecipeModel.objects.values_list(
+            'recipe_id', 'ingredient__name'
+        ):
+            add(pk, name, WEIGHT_INGREDIENT)
+
+        return sorted(postings), dict(postings)
+
+    def get_index(self):
+        # Версия читается до сборки: запись, закоммиченная во время неё,
+        # поднимет версию, и следующий поиск соберёт индекс снова.
+        version = self.version.get()
+        index = self._index
+        if index is not None and index[0] == version:
+            return index[1]
+        with self._lock:
+            if self._index is None or self._index[0] != version:
+                self._index = (version, self.build())
+            return self._index[1]
+
+    @staticmethod
+    def match(index, word):
+        tokens, postings = index
+        prefix = stem(word)
+        scores = defaultdict(float)
+        position = bisect.bisect_left(tokens, prefix)
+        while position < len(tokens):
+            token = tokens[position]
+            if not token.startswith(prefix):
+                break
+            for pk, weight in postings[token].items():
+                scores[pk] = max(scores[pk], weight)
+            position += 1
+        return scores
+
+    def search(self, query):
+        """ {id рецепта: вес}; рецепт должен содержать все слова запроса. """
+        index = self.get_index()
+        result = None
+        for word in set(tokenize(query)):
+            scores = self.match(index, word)
+            if result is None:
+                result = scores
+                continue
+            result = {
+                pk: score + scores[pk]
+                for pk, score in result.items() if pk in scores
+            }
+        return result or {}
+
+
+recipe_search_index = RecipeSearchIndex(
+    CacheVersion('recipe-search:version')
+)
+
+
+def search_recipes(queryset, query):
+    """
+    Фильтрует рецепты по запросу и добавляет релевантность search_rank.
+    Без PostgreSQL остаются RECIPE_SEARCH_CANDIDATES самых релевантных.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        tsquery = Func(
+            Value(query), function='plainto_tsquery',
+            template=f"%(function)s('{SEARCH_CONFIG}', %(expressions)s)",
+        )
+        return queryset.filter(search_vector__matches=query).annotate(
+            search_rank=Func(
+                F('search_vector'), tsquery,
+                function='ts_rank', output_field=FloatField(),
+            )
+        )
+
+    scores = recipe_search_index.search(query)
+    top = heapq.nlargest(
+        settings.RECIPE_SEARCH_CANDIDATES, scores.items(),
+        key=lambda item: (item[1], item[0]),
+    )
+    # Весов немного, поэтому ветви CASE группируются по весу.
+    groups = defaultdict(list)
+    for pk, score in top:
+        groups[score].append(pk)
+    return queryset.filter(pk__in=[pk for pk, _ in top]).annotate(
+        search_rank=Case(
+            *(
+                When(pk__in=pks, then=Value(score))
+                for score, pks in groups.items()
+            ),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
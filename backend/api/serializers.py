@@ -1,19 +1,21 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.exceptions import BadRequest
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.exceptions import ValidationError
-from rest_framework.serializers import (CharField, IntegerField,
-                                        ModelSerializer,
+from rest_framework.serializers import (CharField, FloatField, IntegerField,
+                                        ListField, ModelSerializer,
                                         PrimaryKeyRelatedField, Serializer,
                                         SerializerMethodField)
 
-from recipes.models import Favorite as FavoriteModel
+from api.memberships import membership_cache
 from recipes.models import Ingredient as IngredientModel
 from recipes.models import IngredientRecipe as IngredientRecipeModel
 from recipes.models import Recipe as RecipeModel
-from recipes.models import ShoppingСart as ShoppingСartModel
+from recipes.models import ShoppingListItem as ShoppingListItemModel
 from recipes.models import Tag as TagModel
 from recipes.validators import validate_name as validate_tagname
 from users.validators import validate_name, validate_username
@@ -97,14 +99,15 @@ class UserWSubscriptionSerializer(UserSerializer):
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + (
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
+        read_only_fields = ('recipes_count', 'followers_count')
 
     def get_is_subscribed(self, instance):
-        request = self.context.get('request')
-        if request.user.is_anonymous:
-            return False
-
-        return instance.following.filter(user=request.user).exists()
+        return membership_cache.for_request(
+            self.context.get('request')
+        ).is_subscribed(instance.pk)
 
 
 class DummyUserSerializer(Serializer):
@@ -146,7 +149,60 @@ class IngredientInRecipeSerializer(ModelSerializer):
         read_only_fields = fields
 
 
-class RecipeReadSerializer(ModelSerializer):
+class ShoppingListItemSerializer(ModelSerializer):
+
+    id = IntegerField(source="ingredient_id")
+    name = CharField(source="ingredient.name")
+    measurement_unit = CharField(source="ingredient.measurement_unit")
+    amount = IntegerField(source="total")
+
+    class Meta:
+        model = ShoppingListItemModel
+        fields = (
+            "id", "name", "measurement_unit", "amount",
+        )
+        read_only_fields = fields
+
+
+class RecipeImageSerializer(ModelSerializer):
+    """
+    image - фото в размере ?image_size=card|list (по умолчанию оригинал),
+    images - ссылки на все подготовленные копии, в том числе WebP.
+    """
+
+    image = SerializerMethodField()
+    images = SerializerMethodField()
+
+    def _image_url(self, name):
+        if not name:
+            return None
+
+        url = default_storage.url(name)
+        request = self.context.get("request")
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_image(self, instance):
+        request = self.context.get("request")
+        size = request and request.query_params.get("image_size")
+        variant = instance.image_variants.get(size)
+        if variant:
+            return self._image_url(variant["jpeg"])
+        return self._image_url(instance.image.name)
+
+    def get_images(self, instance):
+        images = {"full": self._image_url(instance.image.name)}
+        for size in settings.RECIPE_IMAGE_VARIANTS:
+            variant = instance.image_variants.get(size, {})
+            images[size] = {
+                image_format: self._image_url(name)
+                for image_format, name in variant.items()
+            }
+        return images
+
+
+class RecipeReadSerializer(RecipeImageSerializer):
     tags = TagSerializer(read_only=True, many=True)
     author = UserWSubscriptionSerializer(read_only=True)
     is_favorited = SerializerMethodField()
@@ -154,32 +210,24 @@ class RecipeReadSerializer(ModelSerializer):
     ingredients = IngredientInRecipeSerializer(
         source="ingredientrecipes", many=True
     )
-    image = Base64ImageField(read_only=True)
 
     class Meta:
         model = RecipeModel
         fields = (
             "id", "tags", "author", "ingredients", "is_favorited",
-            "is_in_shopping_cart", "name", "image", "text", "cooking_time",
+            "is_in_shopping_cart", "name", "image", "images", "text",
+            "cooking_time", "favorites_count", "in_carts_count",
         )
 
     def get_is_in_shopping_cart(self, instance):
-        request = self.context.get("request")
-        if request.user.is_anonymous:
-            return False
-
-        return ShoppingСartModel.objects.filter(
-            user=request.user, recipe=instance
-        ).exists()
+        return membership_cache.for_request(
+            self.context.get("request")
+        ).is_in_shopping_cart(instance.pk)
 
     def get_is_favorited(self, instance):
-        request = self.context.get("request")
-        if request.user.is_anonymous:
-            return False
-
-        return FavoriteModel.objects.filter(
-            user=request.user, recipe=instance
-        ).exists()
+        return membership_cache.for_request(
+            self.context.get("request")
+        ).is_favorited(instance.pk)
 
 
 class IngredientInRecipeWriteSerializer(Serializer):
@@ -190,12 +238,6 @@ class IngredientInRecipeWriteSerializer(Serializer):
     class Meta:
         fields = ("id", "amount")
 
-    def validate_id(self, id_value):
-        if not IngredientModel.objects.filter(pk=id_value).exists():
-            raise ValidationError("Specified ingredient does not exists")
-
-        return id_value
-
 
 class RecipeWriteSerializer(ModelSerializer):
 
@@ -224,8 +266,18 @@ class RecipeWriteSerializer(ModelSerializer):
         if len(set(ids)) != len(ids):
             raise ValidationError("Ингредиенты должны быть уникальными.")
 
+        missing = set(ids) - set(IngredientModel.objects.filter(
+            pk__in=ids
+        ).values_list("pk", flat=True))
+        if missing:
+            raise ValidationError(
+                "Specified ingredient does not exists: "
+                + ", ".join(map(str, sorted(missing)))
+            )
+
         return value
 
+    @transaction.atomic
     def create(self, validated_data):
 
         request = self.context.get("request")
@@ -237,70 +289,150 @@ class RecipeWriteSerializer(ModelSerializer):
             **validated_data
         )
 
-        for ingr_def in ingredients:
-            recipe.ingredientrecipes.create(
-                ingredient_id=ingr_def["id"],
+        IngredientRecipeModel.objects.bulk_create(
+            IngredientRecipeModel(
                 recipe=recipe,
-                amount=ingr_def["amount"]
+                ingredient_id=ingr_def["id"],
+                amount=ingr_def["amount"],
             )
+            for ingr_def in ingredients
+        )
 
         recipe.tags.set(tags)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+
+        # Параллельные правки одного рецепта выполняются по очереди.
+        RecipeModel.objects.select_for_update().filter(
+            pk=instance.pk
+        ).first()
 
         for key, value in validated_data.items():
             setattr(instance, key, value)
 
-        instance.tags.set(tags)
-        instance.ingredientrecipes.all().delete()
-        for ingr_def in ingredients:
-            instance.ingredientrecipes.create(
-                ingredient_id=ingr_def["id"],
-                recipe=instance,
-                amount=ingr_def["amount"]
-            )
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self._update_ingredients(instance, ingredients)
 
         instance.save()
         return instance
 
+    def _update_ingredients(self, instance, ingredients):
+        """ Вставляет, меняет и удаляет только отличающиеся строки. """
+        current = {
+            item.ingredient_id: item
+            for item in IngredientRecipeModel.objects.filter(recipe=instance)
+        }
+        amounts = {x["id"]: x["amount"] for x in ingredients}
+
+        to_create = [
+            IngredientRecipeModel(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount,
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        to_update = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                to_update.append(item)
+        to_delete = current.keys() - amounts.keys()
+
+        if to_create:
+            IngredientRecipeModel.objects.bulk_create(to_create)
+        if to_update:
+            IngredientRecipeModel.objects.bulk_update(to_update, ["amount"])
+        if to_delete:
+            instance.ingredientrecipes.filter(
+                ingredient_id__in=to_delete
+            ).delete()
+
+        # Удаление строк пересчитывают сигналы, bulk_* их не шлют.
+        changed = (
+            {item.ingredient_id for item in to_create}
+            | {item.ingredient_id for item in to_update}
+        )
+        if changed:
+            ShoppingListItemModel.objects.refresh_recipe(
+                instance, ingredients=changed,
+            )
+
+
+class CookableQuerySerializer(Serializer):
+    """ ?ingredients=1,2,3&max_missing=2 """
+    ingredients = ListField(
+        child=IntegerField(min_value=1), allow_empty=False, max_length=100
+    )
+    max_missing = IntegerField(min_value=0, required=False)
+
+    def to_internal_value(self, data):
+        ingredients = []
+        for value in data.getlist("ingredients"):
+            ingredients.extend(part for part in value.split(",") if part)
+        data = {"ingredients": ingredients, **{
+            name: value for name, value in data.items()
+            if name == "max_missing"
+        }}
+        return super().to_internal_value(data)
+
+
+class RecipeIdsSerializer(Serializer):
+    """ {"recipes": [1, 2, 3]} для пакетных избранного и корзины. """
+    recipes = ListField(
+        child=IntegerField(min_value=1), allow_empty=False, max_length=100
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
 
-class RecipeSimpleSerializer(ModelSerializer):
+class CookableRecipeSerializer(RecipeReadSerializer):
+    matched_count = IntegerField(read_only=True)
+    missing_count = IntegerField(read_only=True)
+    coverage = FloatField(read_only=True)
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + (
+            "matched_count", "missing_count", "coverage",
+        )
+
+
+class RecipeSimpleSerializer(RecipeImageSerializer):
 
     class Meta:
         model = RecipeModel
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "images", "cooking_time")
+
+
+class SimilarRecipeSerializer(RecipeSimpleSerializer):
+    score = FloatField(read_only=True)
+
+    class Meta(RecipeSimpleSerializer.Meta):
+        fields = RecipeSimpleSerializer.Meta.fields + ("score",)
 
 
 class UserWithRecipesSerializer(UserSerializer):
 
     recipes = SerializerMethodField(read_only=True)
-    recipes_count = IntegerField(source='recipes.count', read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + (
             "recipes",
             "recipes_count",
+            "followers_count",
         )
+        read_only_fields = ("recipes_count", "followers_count")
 
     def get_recipes(self, instance):
-
-        recipes_limit = self.context.get("recipes_limit", None)
-        try:
-            if recipes_limit is not None:
-                recipes_limit = int(recipes_limit)
-        except ValueError:
-            raise BadRequest(
-                "Недопустимый запрос. Должно быть число."
-            )
-
-        queryset = instance.recipes.order_by("-pub_date")
-        rv = queryset.all()
-
-        if recipes_limit is not None:
-            rv = rv[:recipes_limit]
-
-        serializer = RecipeSimpleSerializer(instance=rv, many=True)
+        recipes = self.context["recipes_by_author"].get(instance.pk, ())
+        serializer = RecipeSimpleSerializer(
+            instance=recipes, many=True, context=self.context
+        )
         return serializer.data
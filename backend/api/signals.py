@@ -0,0 +1,118 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from api import feed
+from api.authentication import token_cache
+from api.caches import (ingredients_payload, recipes_cache,
+                        shopping_list_cache, tags_payload)
+from api.cookable import ingredient_recipe_index
+from api.memberships import membership_cache
+from api.search import recipe_search_index
+from jobs.queue import enqueue
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingСart, Tag, TagRecipe)
+from users.models import Follow
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    tags_payload.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    ingredients_payload.invalidate()
+    transaction.on_commit(shopping_list_cache.bump)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+@receiver((post_save, post_delete), sender=TagRecipe)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes(**kwargs):
+    # Избранное, корзина и подписки меняют только счётчики: в кэше
+    # анонимных ответов они отстают не дольше RECIPES_CACHE_TIMEOUT.
+    transaction.on_commit(recipes_cache.bump)
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_recipes_for_user(update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(recipes_cache.bump)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingСart)
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_memberships(instance, **kwargs):
+    membership_cache.invalidate(instance.user_id)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_search_index(**kwargs):
+    transaction.on_commit(recipe_search_index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def reindex_recipe_ingredients(instance, **kwargs):
+    transaction.on_commit(
+        lambda: ingredient_recipe_index.refresh_recipe(instance.pk)
+    )
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def reindex_recipe_ingredients_for_link(instance, **kwargs):
+    transaction.on_commit(
+        lambda: ingredient_recipe_index.refresh_recipe(instance.recipe_id)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, raw=False, **kwargs):
+    if created and not raw and feed.fan_out_enabled():
+        enqueue(
+            feed.fan_out_recipe, instance.pk,
+            dedup_key=f'feed-fan-out:{instance.pk}',
+        )
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(instance, created, raw=False, **kwargs):
+    if created and not raw and feed.fan_out_enabled():
+        enqueue(
+            feed.backfill, instance.user_id, instance.author_id,
+            dedup_key=feed.backfill_key(instance.user_id, instance.author_id),
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def trim_feed(instance, **kwargs):
+    if feed.fan_out_enabled():
+        feed.trim(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    # Сразу и после коммита: параллельный запрос мог успеть
+    # положить в кэш снимок, прочитанный до удаления.
+    token_cache.invalidate(instance.key)
+    transaction.on_commit(lambda: token_cache.invalidate(instance.key))
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_user_tokens(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    token_cache.invalidate_user(instance.pk)
+    transaction.on_commit(lambda: token_cache.invalidate_user(instance.pk))
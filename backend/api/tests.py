@@ -0,0 +1,431 @@
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import feed
+from api.authentication import TokenCache, token_cache
+from api.cookable import IngredientRecipeIndex, ingredient_recipe_index
+from api.search import recipe_search_index
+from jobs.models import Job
+from jobs.queue import tasks
+from recipes.models import (FeedItem, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, User)
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        password='secret', first_name='Имя', last_name='Фамилия',
+    )
+
+
+def create_recipe(author, name, **fields):
+    fields = {
+        'text': 'Текст', 'cooking_time': 10,
+        'image': 'recipes/images/dish.jpg', **fields,
+    }
+    return Recipe.objects.create(author=author, name=name, **fields)
+
+
+def run_jobs(prefix=''):
+    """ То, что сделал бы воркер: задачи из очереди по порядку. """
+    for job in Job.objects.filter(name__startswith=prefix).order_by('pk'):
+        tasks[job.name](*job.args)
+        job.delete()
+
+
+@override_settings(JOBS_INLINE=False)
+class APITestCase(TestCase):
+    """ Пользователь с клиентом и пустой общий кэш. """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('cook')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class CursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = [
+            create_recipe(self.user, f'Рецепт {number}')
+            for number in range(7)
+        ]
+
+    def pages(self, params):
+        url, params, ids = '/api/recipes/', dict(params, limit=3), []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url, params = response.data['next'], None
+            # Счётчик меняется между страницами.
+            Recipe.objects.filter(pk=self.recipes[0].pk).update(
+                favorites_count=len(ids)
+            )
+        return ids
+
+    def test_cursor_ignores_ordering(self):
+        expected = [
+            recipe.pk for recipe in
+            sorted(self.recipes, key=lambda r: (-r.pub_date.timestamp(), r.pk))
+        ]
+        for params in (
+            {'pagination': 'cursor'},
+            {'pagination': 'cursor', 'ordering': '-favorites_count'},
+            {'pagination': 'cursor', 'search': 'рецепт'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.pages(params), expected)
+
+
+class SearchTests(APITestCase):
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_index_follows_writes_from_other_processes(self):
+        soup = create_recipe(self.user, 'Суп')
+        self.assertEqual(self.search('суп'), [soup.pk])
+
+        # Запись из другого процесса: локальный индекс не тронут,
+        # меняется только версия в общем кэше.
+        Recipe.objects.filter(pk=soup.pk).update(name='Борщ')
+        recipe_search_index.version.bump()
+        self.assertEqual(self.search('суп'), [])
+        self.assertEqual(self.search('борщ'), [soup.pk])
+
+    @override_settings(RECIPE_SEARCH_CANDIDATES=2)
+    def test_candidates_are_capped_by_rank(self):
+        in_name = [create_recipe(self.user, f'Суп {n}') for n in range(2)]
+        for number in range(3):
+            create_recipe(self.user, f'Рецепт {number}', text='Почти суп')
+        recipe_search_index.invalidate()
+        self.assertCountEqual(
+            self.search('суп'), [recipe.pk for recipe in in_name]
+        )
+
+
+def create_ingredients(*names):
+    return [
+        Ingredient.objects.create(name=name, measurement_unit='г')
+        for name in names
+    ]
+
+
+def link_ingredients(recipe, ingredients):
+    IngredientRecipe.objects.bulk_create(
+        IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+        for ingredient in ingredients
+    )
+
+
+class CookableTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        ingredient_recipe_index.reset()
+        self.flour, self.milk, self.eggs = create_ingredients(
+            'мука', 'молоко', 'яйца'
+        )
+        self.pancakes = create_recipe(self.user, 'Блины')
+        link_ingredients(self.pancakes, (self.flour, self.milk))
+        self.omelette = create_recipe(self.user, 'Омлет')
+        link_ingredients(self.omelette, (self.milk, self.eggs, self.flour))
+        self.boiled = create_recipe(self.user, 'Яйца')
+        link_ingredients(self.boiled, (self.eggs,))
+
+    def cookable(self, *ingredients, **params):
+        response = self.client.get('/api/recipes/cookable/', {
+            'ingredients': ','.join(str(item.pk) for item in ingredients),
+            **params,
+        })
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe['id'], recipe['missing_count'])
+            for recipe in response.data['results']
+        ]
+
+    def test_ranked_by_coverage(self):
+        self.assertEqual(self.cookable(self.flour, self.milk), [
+            (self.pancakes.pk, 0), (self.omelette.pk, 1),
+        ])
+        self.assertEqual(
+            self.cookable(self.flour, self.milk, max_missing=0),
+            [(self.pancakes.pk, 0)],
+        )
+
+    def test_write_in_this_process_patches_index(self):
+        self.cookable(self.eggs)
+        link_ingredients(self.boiled, (self.milk,))
+        with mock.patch.object(IngredientRecipeIndex, '_build') as build:
+            ingredient_recipe_index.refresh_recipe(self.boiled.pk)
+            self.assertEqual(self.cookable(self.eggs, self.milk), [
+                (self.boiled.pk, 0), (self.omelette.pk, 1),
+                (self.pancakes.pk, 1),
+            ])
+        build.assert_not_called()
+
+    def test_write_in_other_process_rebuilds_index(self):
+        self.cookable(self.eggs)
+        link_ingredients(self.boiled, (self.milk,))
+        ingredient_recipe_index.version.bump()
+        self.assertEqual(self.cookable(self.milk, self.eggs)[0], (
+            self.boiled.pk, 0
+        ))
+
+
+@override_settings(JOBS_INLINE=False)
+class CookableWarmUpTests(TransactionTestCase):
+    """ Запись, закоммиченная во время прогрева, не теряется. """
+
+    def test_write_during_warm_up(self):
+        cache.clear()
+        ingredient_recipe_index.reset()
+        user = create_user('cook')
+        flour, milk = create_ingredients('мука', 'молоко')
+        recipe = create_recipe(user, 'Блины')
+        link_ingredients(recipe, (flour,))
+        build = IngredientRecipeIndex._build
+        writers = []
+
+        def refresh():
+            ingredient_recipe_index.refresh_recipe(recipe.pk)
+            connection.close()
+
+        def build_after_write(links):
+            # Выборка для прогрева уже сделана, запись идёт после неё.
+            link_ingredients(recipe, (milk,))
+            writer = threading.Thread(target=refresh)
+            writer.start()
+            writers.append(writer)
+            return build(links)
+
+        with mock.patch.object(
+            IngredientRecipeIndex, '_build', side_effect=build_after_write
+        ):
+            ingredient_recipe_index.warm()
+        writers[0].join()
+
+        self.assertTrue(ingredient_recipe_index.ready)
+        self.assertEqual(
+            ingredient_recipe_index.search([milk.pk]),
+            [(recipe.pk, 1, 1, 0.5)],
+        )
+
+
+class FeedTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        self.old = create_recipe(self.author, 'Старый')
+        create_recipe(create_user('stranger'), 'Чужой')
+
+    def subscribe(self, method='post'):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 300)
+
+    def feed(self, **params):
+        response = self.client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def check_strategy(self):
+        self.subscribe()
+        run_jobs('api.feed.')
+        self.assertEqual(self.feed(), [self.old.pk])
+
+        new = create_recipe(self.author, 'Новый')
+        run_jobs('api.feed.')
+        self.assertEqual(self.feed(), [new.pk, self.old.pk])
+        Recipe.objects.filter(pk=self.old.pk).update(favorites_count=5)
+        self.assertEqual(
+            self.feed(ordering='-favorites_count', limit=1), [new.pk]
+        )
+
+        self.subscribe('delete')
+        run_jobs('api.feed.')
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_STRATEGY='fanin')
+    def test_fan_in(self):
+        self.check_strategy()
+
+    @override_settings(FEED_STRATEGY='fanout')
+    def test_fan_out(self):
+        self.check_strategy()
+
+    @override_settings(FEED_STRATEGY='fanout')
+    def test_unfollow_before_jobs_run(self):
+        self.subscribe()
+        create_recipe(self.author, 'Новый')
+        self.subscribe('delete')
+        self.assertFalse(Job.objects.filter(
+            dedup_key=feed.backfill_key(self.user.pk, self.author.pk)
+        ).exists())
+
+        run_jobs('api.feed.')
+        # Задача, уже взятая воркером до отписки.
+        feed.backfill(self.user.pk, self.author.pk)
+        self.assertFalse(FeedItem.objects.filter(user=self.user).exists())
+
+
+class LinkTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.flour, = create_ingredients('мука')
+        self.pancakes, self.pie = (
+            create_recipe(self.user, name) for name in ('Блины', 'Пирог')
+        )
+        link_ingredients(self.pancakes, (self.flour,))
+        link_ingredients(self.pie, (self.flour,))
+
+    def counts(self, field):
+        recipes = Recipe.objects.order_by('pk')
+        return list(recipes.values_list(field, flat=True))
+
+    def test_single_favorite(self):
+        url = f'/api/recipes/{self.pie.pk}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.counts('favorites_count'), [0, 1])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.counts('favorites_count'), [0, 0])
+        self.assertEqual(
+            self.client.post('/api/recipes/999/favorite/').status_code, 404
+        )
+
+    def test_single_cart_refreshes_totals_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/recipes/{self.pie.pk}/shopping_cart/'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list('user', 'total')),
+            [(self.user.pk, 1)],
+        )
+
+    def test_bulk_statuses(self):
+        ids = [self.pancakes.pk, self.pie.pk, 999]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{self.pie.pk}/shopping_cart/')
+            response = self.client.post(
+                '/api/recipes/shopping_cart/', {'recipes': ids}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['results'], [
+            {'id': self.pancakes.pk, 'status': 'added'},
+            {'id': self.pie.pk, 'status': 'already_added'},
+            {'id': 999, 'status': 'not_found'},
+        ])
+        self.assertEqual(self.counts('in_carts_count'), [1, 1])
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).total, 2
+        )
+
+        response = self.client.delete(
+            '/api/recipes/shopping_cart/',
+            {'recipes': [self.pancakes.pk, self.pancakes.pk + 1000]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['removed', 'not_found'],
+        )
+        self.assertEqual(self.counts('in_carts_count'), [0, 1])
+
+
+class TokenCacheTests(TestCase):
+    """ Снимок токена сбрасывается при выходе и блокировке. """
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user('cook')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def check_logout(self):
+        self.assertEqual(self.me(), 200)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.me(), 401)
+
+    def test_logout_local(self):
+        with mock.patch.object(token_cache, 'shared', False):
+            self.check_logout()
+
+    def test_logout_shared_is_seen_by_other_processes(self):
+        other = TokenCache(60, 10, shared=True)
+        with mock.patch.object(token_cache, 'shared', True):
+            self.check_logout()
+        self.assertIsNone(other.get(self.token.key))
+
+    def test_deactivated_user(self):
+        for shared in (False, True):
+            patch = mock.patch.object(token_cache, 'shared', shared)
+            with self.subTest(shared=shared), patch:
+                self.user.is_active = True
+                self.user.save()
+                self.assertEqual(self.me(), 200)
+                self.user.is_active = False
+                self.user.save()
+                self.assertEqual(self.me(), 401)
+
+
+class MembershipFlagsTests(APITestCase):
+    """ Флаги is_favorited, is_in_shopping_cart, is_subscribed. """
+
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        self.recipe = create_recipe(self.author, 'Блины')
+
+    def flags(self):
+        recipe = self.client.get(f'/api/recipes/{self.recipe.pk}/').data
+        return (
+            recipe['is_favorited'], recipe['is_in_shopping_cart'],
+            recipe['author']['is_subscribed'],
+        )
+
+    def test_flags_follow_writes(self):
+        self.assertEqual(self.flags(), (False, False, False))
+        urls = (
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            f'/api/users/{self.author.pk}/subscribe/',
+        )
+        for url in urls:
+            self.client.post(url)
+        self.assertEqual(self.flags(), (True, True, True))
+
+        self.client.delete(urls[0])
+        self.assertEqual(self.flags(), (False, True, True))
+        # Запись мимо API тоже сбрасывает флаги.
+        self.author.following.all().delete()
+        self.assertEqual(self.flags(), (False, True, False))
+
+    def test_other_users_flags(self):
+        self.client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.flags(), (False, False, False))
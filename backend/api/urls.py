@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from api.views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                       UserViewSet, metrics)
 
 app_name = 'api'
 
@@ -12,6 +13,7 @@ router.register('ingredients', IngredientViewSet, 'ingredients')
 router.register('recipes', RecipeViewSet, 'recipes')
 
 urlpatterns = [
+    path('_metrics', metrics, name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
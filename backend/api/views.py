@@ -1,30 +1,51 @@
+from collections import defaultdict
+
 from django.contrib.auth import get_user_model
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.core.exceptions import BadRequest
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as BaseUserViewSet
 from rest_framework import status
-from rest_framework.decorators import action
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.paginations import CustomPagination
+from api.autocomplete import ingredient_index
+from api.caches import (ingredients_payload, recipes_cache,
+                        shopping_list_cache, tags_payload)
+from api.cookable import ingredient_recipe_index
+from api.exports import SHOPPING_CART_RENDERERS, shopping_cart_rows
+from api.feed import fan_out_enabled, fan_out_page, feed_queryset
+from api.filters import IngredientFilter, RecipeFilter, RecipeOrderingFilter
+from api.memberships import membership_cache
+from api.metrics import registry
+from api.paginations import (CustomPagination, KeysetPagination,
+                             PagePagination, UserPagination)
 from api.permissions import IsAuthorOrAdminOrReadOnly
-from api.serializers import (DummyUserSerializer, IngredientSerializer,
+from api.serializers import (CookableQuerySerializer,
+                             CookableRecipeSerializer, DummyUserSerializer,
+                             IngredientSerializer, RecipeIdsSerializer,
                              RecipeReadSerializer, RecipeSimpleSerializer,
-                             RecipeWriteSerializer, TagSerializer,
+                             RecipeWriteSerializer,
+                             ShoppingListItemSerializer,
+                             SimilarRecipeSerializer, TagSerializer,
                              UserCreateSerializer, UserSerializer,
                              UserWithRecipesSerializer,
                              UserWSubscriptionSerializer)
 from recipes.models import Favorite as FavoriteModel
 from recipes.models import Ingredient as IngredientModel
-from recipes.models import IngredientRecipe as IngredientRecipeModel
 from recipes.models import Recipe as RecipeModel
+from recipes.models import RecipeSimilarity as RecipeSimilarityModel
+from recipes.models import ShoppingListItem as ShoppingListItemModel
 from recipes.models import ShoppingСart as ShoppingСartModel
 from recipes.models import Tag as TagModel
+from recipes.models import counter_shifts, shift_counter
+from recipes.signals import pending_shopping_lists
 
 UserModel = get_user_model()
 
@@ -34,15 +55,52 @@ class UserViewSet(BaseUserViewSet):
     queryset = UserModel.objects.all()
     serializer_class = UserSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    pagination_class = CustomPagination
+    pagination_class = UserPagination
+
+    def _get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get("recipes_limit")
+        if recipes_limit is None:
+            return None
+
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            raise BadRequest("Недопустимый запрос. Должно быть число.")
+
+        if recipes_limit < 0:
+            raise BadRequest("Недопустимый запрос. Должно быть число.")
+
+        return recipes_limit
 
-    def _get_subs_context(self):
+    def _get_subs_context(self, authors):
+        """ Рецепты всех авторов страницы собираются одним запросом. """
         context = self.get_serializer_context()
-        context["recipes_limit"] = self.request.query_params.get(
-            "recipes_limit", None
+        recipes_by_author = defaultdict(list)
+        recipes = RecipeModel.objects.latest_by_author(
+            [author.pk for author in authors], self._get_recipes_limit()
         )
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+
+        context["recipes_by_author"] = recipes_by_author
         return context
 
+    def _get_subscriptions_response(self, response_status):
+        queryset = UserModel.objects.filter(
+            following__user=self.request.user
+        ).order_by("username")
+        page = self.paginate_queryset(queryset)
+        authors = list(queryset) if page is None else page
+        serializer = UserWithRecipesSerializer(
+            authors, many=True, context=self._get_subs_context(authors)
+        )
+        if page is None:
+            return Response(serializer.data, status=response_status)
+
+        response = self.get_paginated_response(serializer.data)
+        response.status_code = response_status
+        return response
+
     def get_serializer_class(self):
         if self.action == "subscribe":
             return DummyUserSerializer
@@ -58,6 +116,7 @@ class UserViewSet(BaseUserViewSet):
         methods=['POST', 'DELETE'],
         permission_classes=(IsAuthenticated,),
     )
+    @transaction.atomic
     def subscribe(self, request, *args, **kwargs):
         """ Управление подписками - добавление и удаление. """
         author_id = kwargs["id"]
@@ -90,24 +149,7 @@ class UserViewSet(BaseUserViewSet):
                 })
 
             author.following.create(user=request.user)
-
-            subs_context = self._get_subs_context()
-            queryset = self.get_queryset()
-            queryset = queryset.filter(following__user=self.request.user)
-            queryset = self.filter_queryset(queryset)
-            page = self.paginate_queryset(queryset)
-            if page is not None:
-                serializer = UserWithRecipesSerializer(
-                    page, many=True, context=subs_context
-                )
-                response = self.get_paginated_response(serializer.data)
-                response.status = status.HTTP_201_CREATED
-                return response
-
-            serializer = UserWithRecipesSerializer(
-                queryset, many=True, context=subs_context
-            )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return self._get_subscriptions_response(status.HTTP_201_CREATED)
 
     @action(
         detail=False,
@@ -116,21 +158,7 @@ class UserViewSet(BaseUserViewSet):
     )
     def subscriptions(self, request, *args, **kwargs):
         """ Получение списка подписок """
-        context = self._get_subs_context()
-        queryset = self.get_queryset()
-        queryset = queryset.filter(following__user=request.user)
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = UserWithRecipesSerializer(
-                page, many=True, context=context
-            )
-            return self.get_paginated_response(serializer.data)
-
-        queryset = queryset.all()
-        serializer = UserWithRecipesSerializer(
-            instance=queryset, many=True, context=context
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self._get_subscriptions_response(status.HTTP_200_OK)
 
 
 class TagViewSet(ReadOnlyModelViewSet):
@@ -140,6 +168,9 @@ class TagViewSet(ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return tags_payload.response(request)
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     """ Работа с ингредиентами."""
@@ -150,15 +181,90 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        if not request.query_params:
+            return ingredients_payload.response(request)
+
+        name = request.query_params.get("name")
+        if name and set(request.query_params) == {"name"}:
+            if ingredient_index.ready:
+                return Response(ingredient_index.search(name))
+            ingredient_index.warm_in_background()
+
+        return super().list(request, *args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == "list" and self.request.query_params.get("name"):
+            return queryset[:ingredient_index.limit]
+        return queryset
+
+
+class ResponseCacheMixin:
+    """
+    Кэширует ответы list и retrieve для анонимных запросов: у них нет
+    полей, зависящих от пользователя.
+    """
+    response_cache = None
+    cached_actions = ("list", "retrieve")
+    response_cache_key = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            self.action in self.cached_actions
+            and request.method == "GET"
+            and request.user.is_anonymous
+        ):
+            variant = (
+                request.accepted_media_type,
+                request.headers.get("X-Pagination"),
+            )
+            self.response_cache_key = self.response_cache.key(
+                request, variant
+            )
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_or(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_or(super().retrieve, request, *args, **kwargs)
+
+    def _cached_or(self, handler, request, *args, **kwargs):
+        if self.response_cache_key is not None:
+            response = self.response_cache.get(self.response_cache_key)
+            if response is not None:
+                return response
+        return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if (
+            self.response_cache_key is not None
+            and isinstance(response, Response)
+            and response.status_code == status.HTTP_200_OK
+        ):
+            response.render()
+            self.response_cache.set(self.response_cache_key, response)
+        return response
 
-class RecipeViewSet(ModelViewSet):
+
+class RecipeViewSet(ResponseCacheMixin, ModelViewSet):
     """ Работа с рецептами. """
     queryset = RecipeModel.objects.all()
     serializer_class = RecipeReadSerializer
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ("pub_date", "favorites_count")
+    ordering = ("-pub_date", "id")
     pagination_class = CustomPagination
+    response_cache = recipes_cache
+
+    def get_queryset(self):
+        return RecipeModel.objects.with_related()
 
     def create(self, request, *args, **kwargs):
         write_serializer = RecipeWriteSerializer(
@@ -168,7 +274,7 @@ class RecipeViewSet(ModelViewSet):
         self.perform_create(write_serializer)
 
         read_serializer = self.get_serializer(
-            instance=write_serializer.instance
+            instance=self.get_queryset().get(pk=write_serializer.instance.pk)
         )
         headers = self.get_success_headers(data=read_serializer.data)
         return Response(
@@ -188,11 +294,8 @@ class RecipeViewSet(ModelViewSet):
         write_serializer.is_valid(raise_exception=True)
         self.perform_update(write_serializer)
 
-        if getattr(instance, '_prefetched_objects_cache', None):
-            instance._prefetched_objects_cache = {}
-
         read_serializer = self.get_serializer(
-            instance=write_serializer.instance
+            instance=self.get_queryset().get(pk=instance.pk)
         )
         headers = self.get_success_headers(data=read_serializer.data)
         return Response(
@@ -208,42 +311,10 @@ class RecipeViewSet(ModelViewSet):
     )
     def favorite(self, request, *args, **kwargs):
         """ Добавление и удаление рецепта в избранные """
-        recipe_id = kwargs["pk"]
-
-        try:
-            recipe = RecipeModel.objects.get(pk=recipe_id)
-        except RecipeModel.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
-
-        if request.method == "DELETE":
-            query = FavoriteModel.objects.filter(
-                user=request.user,
-                recipe=recipe,
-            )
-            affected, _ = query.delete()
-            if not affected:
-                return Response(status=status.HTTP_400_BAD_REQUEST, data={
-                    "errors": "Такого избранного рецепта нет",
-                })
-
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-        elif request.method == "POST":
-            _, created = FavoriteModel.objects.get_or_create(
-                user=request.user,
-                recipe=recipe
-            )
-
-            if not created:
-                return Response(status=status.HTTP_400_BAD_REQUEST, data={
-                    "errors": "Рецепт уже в списке избранных",
-                })
-
-            serializer = RecipeSimpleSerializer(
-                instance=recipe, context=self.get_serializer_context(),
-            )
-
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return self._link(request, FavoriteModel, {
+            "POST": "Рецепт уже в списке избранных",
+            "DELETE": "Такого избранного рецепта нет",
+        })
 
     @action(
         detail=True,
@@ -252,76 +323,246 @@ class RecipeViewSet(ModelViewSet):
     )
     def shopping_cart(self, request, *args, **kwargs):
         """ Добавление и удаление рецептов в корзину """
-        recipe_id = kwargs["pk"]
+        return self._link(request, ShoppingСartModel, {
+            "POST": "Рецепт уже в корзине",
+            "DELETE": "Такого избранного рецепта нет",
+        })
 
-        try:
-            recipe = RecipeModel.objects.get(pk=recipe_id)
-        except RecipeModel.DoesNotExist:
+    @action(
+        detail=False,
+        methods=["POST", "DELETE"],
+        permission_classes=(IsAuthenticated,),
+        url_path="favorite",
+    )
+    def favorite_bulk(self, request, *args, **kwargs):
+        """ Добавление и удаление нескольких рецептов в избранные """
+        return self._bulk_links(request, FavoriteModel, "favorites_count")
+
+    @action(
+        detail=False,
+        methods=["POST", "DELETE"],
+        permission_classes=(IsAuthenticated,),
+        url_path="shopping_cart",
+    )
+    def shopping_cart_bulk(self, request, *args, **kwargs):
+        """ Добавление и удаление нескольких рецептов в корзину """
+        return self._bulk_links(request, ShoppingСartModel, "in_carts_count")
+
+    def _link(self, request, model, errors):
+        """
+        Одна связь user-recipe без блокировки пользователя: гонку решает
+        уникальный индекс, счётчик, флаги и итоги списка покупок обновляют
+        сигналы модели.
+        """
+        recipe = RecipeModel.objects.filter(pk=self.kwargs["pk"]).first()
+        if recipe is None:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
         if request.method == "DELETE":
-            query = ShoppingСartModel.objects.filter(
-                user=request.user,
-                recipe=recipe,
-            )
-            affected, _ = query.delete()
-            if not affected:
+            deleted, _ = model.objects.filter(
+                user=request.user, recipe=recipe
+            ).delete()
+            if not deleted:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={
-                    "errors": "Такого избранного рецепта нет",
+                    "errors": errors["DELETE"],
                 })
-
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        elif request.method == "POST":
-            _, created = ShoppingСartModel.objects.get_or_create(
-                user=request.user,
-                recipe=recipe
-            )
+        try:
+            with transaction.atomic():
+                model.objects.create(user=request.user, recipe=recipe)
+        except IntegrityError:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={
+                "errors": errors["POST"],
+            })
+        serializer = RecipeSimpleSerializer(
+            instance=recipe, context=self.get_serializer_context(),
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @transaction.atomic
+    def _bulk_links(self, request, model, counter):
+        """ Пакетная запись связей user-recipe. """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data["recipes"]
+
+        found = set(RecipeModel.objects.filter(
+            pk__in=recipe_ids
+        ).values_list("pk", flat=True))
+        add = request.method == "POST"
+        changed = self._change_links(request.user, model, counter, found, add)
+        done, skipped = (
+            ("added", "already_added") if add else ("removed", "not_added")
+        )
 
-            if not created:
-                return Response(status=status.HTTP_400_BAD_REQUEST, data={
-                    "errors": "Рецепт уже в корзине",
-                })
+        outcomes = {pk: skipped for pk in found}
+        outcomes.update((pk, done) for pk in changed)
+        return Response(
+            {"results": [
+                {"id": pk, "status": outcomes.get(pk, "not_found")}
+                for pk in recipe_ids
+            ]},
+            status=(
+                status.HTTP_201_CREATED if changed and add
+                else status.HTTP_200_OK
+            ),
+        )
 
-            serializer = RecipeSimpleSerializer(
-                instance=recipe, context=self.get_serializer_context(),
+    @staticmethod
+    def _change_links(user, model, counter, recipe_ids, add):
+        """
+        Пакетно добавляет или удаляет связи user с recipe_ids и возвращает
+        id рецептов, связи с которыми изменил именно этот запрос. Удаление
+        идёт через delete() и его сигналы, сдвиги счётчиков из них
+        применяются пачкой; bulk_create сигналов не шлёт, поэтому для
+        добавленных счётчик, флаги и итоги списка покупок обновляются здесь.
+        """
+        # Все записи связей пользователя идут по очереди.
+        list(UserModel.objects.select_for_update().filter(pk=user.pk))
+        links = model.objects.filter(user=user, recipe_id__in=recipe_ids)
+        present = set(links.values_list("recipe_id", flat=True))
+        if not add:
+            if present:
+                with counter_shifts.batch():
+                    links.delete()
+            return present
+
+        changed = set(recipe_ids) - present
+        if changed:
+            model.objects.bulk_create(
+                model(user=user, recipe_id=pk) for pk in changed
             )
-
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            shift_counter(
+                RecipeModel.objects.filter(pk__in=changed), counter, 1
+            )
+            membership_cache.invalidate(user.pk)
+            if model is ShoppingСartModel:
+                pending_shopping_lists.add([user.pk], recipes=changed)
+        return changed
 
     @action(
         detail=False,
         methods=["GET"],
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
     )
-    def download_shopping_cart(self, request, *args, **kwargs):
-        """ Получение корзины для покупок """
-        items = IngredientRecipeModel.objects.select_related(
-            'recipe', 'ingredient'
-        )
-        if request.user.is_authenticated:
-            items = items.filter(
-                recipe__shopping_cart__user=request.user
-            )
+    def feed(self, request, *args, **kwargs):
+        """ Лента рецептов авторов из подписок, постранично по курсору. """
+        if fan_out_enabled():
+            paginator, page = fan_out_page(request.user, request)
         else:
-            items = items.filter(
-                recipe_id__in=request.session['purchases']
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(
+                feed_queryset(request.user).with_related(), request
             )
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=["GET"])
+    def similar(self, request, *args, **kwargs):
+        """
+        Похожие рецепты, рассчитанные командой build_similar_recipes:
+        один запрос по индексу (recipe, -score).
+        """
+        links = RecipeSimilarityModel.objects.filter(
+            recipe_id=kwargs["pk"]
+        ).select_related("similar").order_by("-score")
+        recipes = []
+        for link in links:
+            link.similar.score = round(link.score, 4)
+            recipes.append(link.similar)
+
+        serializer = SimilarRecipeSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, methods=["GET"])
+    def cookable(self, request, *args, **kwargs):
+        """
+        Что можно приготовить: ?ingredients=1,2,3[&max_missing=K].
+        Рецепты по убыванию доли ингредиентов, которые уже есть.
+        """
+        params = CookableQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        ranked = ingredient_recipe_index.search(
+            params.validated_data["ingredients"],
+            params.validated_data.get("max_missing"),
+        )
+        paginator = PagePagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        recipes = self.get_queryset().in_bulk(pk for pk, *_ in page)
+        results = []
+        for pk, matched, missing, coverage in page:
+            recipe = recipes.get(pk)
+            if recipe is None:
+                continue
+            recipe.matched_count = matched
+            recipe.missing_count = missing
+            recipe.coverage = round(coverage, 4)
+            results.append(recipe)
+
+        serializer = CookableRecipeSerializer(
+            results, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
 
-        items = items.values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            name=F('ingredient__name'),
-            units=F('ingredient__measurement_unit'),
-            total=Sum('amount'),
-        ).order_by('-total')
-
-        text = '\n'.join([
-            f"{item['name']} ({item['units']}) - {item['total']}"
-            for item in items
-        ])
-        filename = "foodgram_shopping_cart.txt"
-        response = HttpResponse(text, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename{filename}'
+    @action(
+        detail=False,
+        methods=["GET"],
+        permission_classes=(IsAuthenticated,),
+        url_path="shopping_cart/totals",
+    )
+    def shopping_cart_totals(self, request, *args, **kwargs):
+        """ Текущие итоги корзины по ингредиентам """
+        items = ShoppingListItemModel.objects.filter(
+            user=request.user
+        ).select_related("ingredient").order_by("-total", "ingredient__name")
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
 
+    @action(
+        detail=False,
+        methods=["GET"],
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_CART_RENDERERS,
+    )
+    def download_shopping_cart(self, request, *args, **kwargs):
+        """
+        Получение корзины для покупок: ?format=txt|csv|json.
+        Файл кэшируется по отпечатку корзины и отдаётся с ETag; при
+        промахе - потоком по мере чтения строк из БД.
+        """
+        renderer = request.accepted_renderer
+        content_type = f'{renderer.media_type}; charset={renderer.charset}'
+        fingerprint = shopping_list_cache.fingerprint(request.user)
+        etag = quote_etag(f'{fingerprint}-{renderer.format}')
+        key = shopping_list_cache.file_key(fingerprint, renderer.format)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = shopping_list_cache.get(key)
+        if response is None:
+            response = StreamingHttpResponse(
+                shopping_list_cache.stream(
+                    key, renderer.stream(shopping_cart_rows(request.user)),
+                    content_type, renderer.charset,
+                ),
+                content_type=content_type,
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        filename = f'foodgram_shopping_cart.{renderer.format}'
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"'
+        )
         return response
+
+
+@api_view(["GET"])
+@permission_classes((IsAdminUser,))
+def metrics(request):
+    """ Метрики процесса в текстовом формате Prometheus. """
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4"
+    )
@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
     'users.apps.UsersConfig',
+    'jobs.apps.JobsConfig',
     'django_filters',
     'djoser',
     'rest_framework',
@@ -29,6 +30,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +72,64 @@ DATABASES = {
 }
 AUTH_USER_MODEL = 'users.User'
 
+# Для нескольких процессов gunicorn нужен общий бэкенд, например
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# и CACHE_LOCATION=/var/tmp/foodgram_cache.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+SHARED_CACHE = CACHES['default']['BACKEND'] != (
+    'django.core.cache.backends.locmem.LocMemCache'
+)
+
+SIMILAR_RECIPES_TOP_K = 10
+# Через сколько секунд после правки рецепта пересчитывать похожие.
+SIMILAR_RECIPES_REFRESH_DELAY = 60
+
+# Лента подписок: 'fanin' - запрос по Follow при чтении, 'fanout' - записи
+# FeedItem, которые фоновые задачи добавляют при публикации рецепта.
+FEED_STRATEGY = os.getenv('FEED_STRATEGY', default='fanin')
+FEED_BACKFILL_LIMIT = 500
+
+# Фоновые задачи (приложение jobs) выполняет manage.py run_worker.
+# JOBS_INLINE=yes - выполнять их в процессе запроса сразу после коммита.
+# Воркер сбрасывает кэши ответов, поэтому ему нужен общий кэш: с кэшем
+# в памяти процесса задачи по умолчанию выполняются в процессе запроса.
+JOBS_INLINE = os.getenv(
+    'JOBS_INLINE', default='no' if SHARED_CACHE else 'yes'
+) == 'yes'
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', default=2))
+JOBS_POLL_INTERVAL = 1
+JOBS_MAX_ATTEMPTS = 5
+# Пауза перед повтором, удваивается с каждой попыткой.
+JOBS_RETRY_DELAY = 10
+JOBS_STALE_AFTER = 600
+
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', default=300))
+SHOPPING_LIST_CACHE_TIMEOUT = 3600
+# Файлы списка покупок больше этого размера отдаются потоком без кэша.
+SHOPPING_LIST_CACHE_MAX_SIZE = 1024 * 1024
+MEMBERSHIP_CACHE_TIMEOUT = int(
+    os.getenv('MEMBERSHIP_CACHE_TIMEOUT', default=3600)
+)
+
+# Снимки токенов: в общем кэше Django, если он задан, иначе в памяти
+# процесса. Выход и блокировка сбрасывают снимок только в том кэше, где
+# прошла запись, поэтому с общим кэшем локальный режим не используется.
+AUTH_TOKEN_CACHE_TIMEOUT = int(
+    os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', default=60)
+)
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_SHARED = os.getenv(
+    'AUTH_TOKEN_CACHE_SHARED', default='yes' if SHARED_CACHE else 'no'
+) == 'yes'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -108,7 +168,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -134,6 +194,25 @@ DJOSER = {
     'HIDE_USERS': False,
 }
 
+# Уменьшенные копии фото рецепта: имя -> (геометрия sorl, опции).
+# Файлы ложатся в MEDIA_ROOT/THUMBNAIL_PREFIX под хешированными именами.
+RECIPE_IMAGE_VARIANTS = {
+    'card': ('96x96', {'crop': 'center', 'quality': 80}),
+    'list': ('480', {'quality': 80}),
+}
+RECIPE_IMAGE_FORMATS = ('JPEG', 'WEBP')
+THUMBNAIL_PREFIX = 'cache/'
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = int(
+    os.getenv('INGREDIENT_AUTOCOMPLETE_LIMIT', default=100)
+)
+
+# Поиск без PostgreSQL отдаёт столько самых релевантных рецептов: каждый
+# кандидат - параметр SQL, а у старых SQLite их не больше 999.
+RECIPE_SEARCH_CANDIDATES = int(
+    os.getenv('RECIPE_SEARCH_CANDIDATES', default=300)
+)
+
 MAX_EMAIL_LENGHT = 254
 MAX_LENGHT_1 = 150
 MAX_LENGHT_2 = 200
@@ -5,3 +5,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+from api.autocomplete import ingredient_index  # noqa: E402
+from api.cookable import ingredient_recipe_index  # noqa: E402
+
+ingredient_index.warm_in_background()
+ingredient_recipe_index.warm_in_background()
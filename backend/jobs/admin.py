@@ -0,0 +1,29 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'name', 'status', 'attempts', 'run_at', 'created_at',
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('^dedup_key',)
+    readonly_fields = ('created_at', 'started_at', 'last_error')
+    actions = ('requeue',)
+
+    @admin.action(description='Поставить упавшие задачи в очередь заново')
+    def requeue(self, request, queryset):
+        for job in queryset.filter(status=Job.FAILED):
+            # Если такая задача уже ждёт, повторная не нужна.
+            if job.dedup_key and Job.objects.filter(
+                dedup_key=job.dedup_key, status=Job.QUEUED
+            ).exists():
+                job.delete()
+                continue
+            job.status = Job.QUEUED
+            job.attempts = 0
+            job.run_at = timezone.now()
+            job.save(update_fields=('status', 'attempts', 'run_at'))
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class JobsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'jobs'
+    verbose_name = 'Фоновые задачи'
+
+    def ready(self):
+        from api.metrics import registry
+        from jobs import checks  # noqa: F401
+        from jobs.queue import collect_queue_metrics
+
+        registry.collector(collect_queue_metrics)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register(Tags.caches)
+def check_shared_cache(**kwargs):
+    """
+    Воркер - отдельный процесс: сброс кэша ответов из задачи виден
+    веб-процессам только через общий кэш.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.JOBS_INLINE or backend != LOCMEM_CACHE:
+        return []
+    return [Error(
+        f'Фоновым задачам нужен общий кэш, а {backend} свой у каждого '
+        'процесса.',
+        hint=(
+            'Задайте CACHE_BACKEND, например FileBasedCache с общим '
+            'CACHE_LOCATION, или JOBS_INLINE=yes.'
+        ),
+        id='jobs.E001',
+    )]
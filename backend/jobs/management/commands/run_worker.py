@@ -0,0 +1,55 @@
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from api.metrics import registry
+from jobs.queue import Worker
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):  # noqa: N802
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет фоновые задачи из таблицы jobs_job в пуле потоков. '
+        'С --burst завершается, когда созревших задач не осталось.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=None)
+        parser.add_argument('--burst', action='store_true')
+        parser.add_argument(
+            '--metrics-port', type=int, default=None,
+            help='Порт для метрик воркера в формате Prometheus.',
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(options['concurrency'], options['poll_interval'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stopping.set())
+
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(
+                ('', options['metrics_port']), MetricsHandler
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        self.stdout.write(
+            f'Воркер запущен: {worker.concurrency} потоков'
+        )
+        worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS('Воркер остановлен'))
@@ -0,0 +1,82 @@
+from django.db import models
+from django.db.models import Q, UniqueConstraint
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    Фоновая задача. Выполненные задачи удаляются, в таблице остаются
+    ожидающие, выполняемые и окончательно упавшие.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(
+        verbose_name='Задача',
+        max_length=200,
+    )
+    args = models.JSONField(
+        verbose_name='Аргументы',
+        default=list,
+    )
+    dedup_key = models.CharField(
+        verbose_name='Ключ дедупликации',
+        max_length=200,
+        null=True,
+        blank=True,
+    )
+    status = models.CharField(
+        verbose_name='Статус',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток',
+        default=0,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Поставлена',
+        auto_now_add=True,
+    )
+    run_at = models.DateTimeField(
+        verbose_name='Выполнить не раньше',
+        default=timezone.now,
+    )
+    started_at = models.DateTimeField(
+        verbose_name='Начата',
+        null=True,
+        blank=True,
+    )
+    last_error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True,
+    )
+
+    class Meta:
+        ordering = ('run_at', 'id')
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(
+                fields=('status', 'run_at'),
+                name='job_status_run_at_idx'
+            ),
+        ]
+        constraints = [
+            # Одинаковая задача ждёт в очереди не больше одного раза.
+            UniqueConstraint(
+                fields=('dedup_key',),
+                condition=Q(status='queued'),
+                name='job_queued_dedup_key_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)}'
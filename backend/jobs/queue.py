@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from api.metrics import registry
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+tasks = {}
+
+queue_depth = registry.gauge(
+    'foodgram_jobs',
+    'Задачи в таблице по имени и статусу.',
+    ('name', 'status'),
+)
+queue_age = registry.gauge(
+    'foodgram_jobs_oldest_queued_seconds',
+    'Сколько ждёт самая старая задача, которой уже пора выполняться.',
+    ('name',),
+)
+job_wait = registry.histogram(
+    'foodgram_job_wait_seconds',
+    'Задержка от срока задачи до начала выполнения.',
+    ('name',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+job_duration = registry.histogram(
+    'foodgram_job_duration_seconds',
+    'Время выполнения задачи.',
+    ('name', 'result'),
+)
+
+
+def task(func):
+    """ Регистрирует функцию как фоновую задачу. """
+    func.job_name = f'{func.__module__}.{func.__name__}'
+    tasks[func.job_name] = func
+    return func
+
+
+class InlineJobs(threading.local):
+    """
+    Задачи JOBS_INLINE, поставленные в текущей транзакции. Выполняются
+    после коммита; задача с тем же dedup_key ставится один раз. Если
+    транзакция откатилась, накопленное выполнится при следующем коммите:
+    задачи сами проверяют, что их работа ещё нужна.
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, func, args, dedup_key=None):
+        key = dedup_key or object()
+        if key in self.pending:
+            return
+        self.pending[key] = (func, args)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        pending = self.pending
+        self.__init__()
+        for func, args in pending.values():
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Ошибка задачи %s%r', func.job_name, args)
+
+
+inline_jobs = InlineJobs()
+
+
+def enqueue(func, *args, dedup_key=None, delay=0):
+    """
+    Ставит задачу в очередь. Строка пишется в текущей транзакции, так что
+    воркер увидит задачу только после коммита, а при откате её не будет.
+    Если задача с тем же dedup_key уже ждёт, новая не добавляется.
+    С JOBS_INLINE задача выполняется в этом же процессе после коммита,
+    а отложенные (delay) пропускаются: они нужны, чтобы слить частые
+    правки в одну тяжёлую задачу, и в запросе им не место.
+    """
+    if settings.JOBS_INLINE:
+        if delay:
+            logger.debug('JOBS_INLINE: пропущена задача %s', func.job_name)
+            return
+        inline_jobs.add(func, args, dedup_key)
+        return
+    Job.objects.bulk_create(
+        [Job(
+            name=func.job_name,
+            args=list(args),
+            dedup_key=dedup_key,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )],
+        ignore_conflicts=True,
+    )
+
+
+def cancel(dedup_key):
+    """ Снимает ожидающую задачу с этим dedup_key, если она ещё в очереди. """
+    if not settings.JOBS_INLINE:
+        Job.objects.filter(dedup_key=dedup_key, status=Job.QUEUED).delete()
+
+
+def collect_queue_metrics():
+    now = timezone.now()
+    depth = {}
+    age = {}
+    rows = Job.objects.values('name', 'status').annotate(
+        total=Count('id'), oldest=Min('run_at'),
+    ).order_by()
+    for row in rows:
+        depth[(row['name'], row['status'])] = row['total']
+        if row['status'] == Job.QUEUED:
+            age[(row['name'],)] = max(
+                0, (now - row['oldest']).total_seconds()
+            )
+    queue_depth.replace(depth)
+    queue_age.replace(age)
+
+
+class Worker:
+    """
+    Забирает созревшие задачи и выполняет их в пуле потоков. Несколько
+    воркеров могут работать одновременно: на PostgreSQL задачи
+    разбираются через SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = concurrency or settings.JOBS_CONCURRENCY
+        self.poll_interval = poll_interval or settings.JOBS_POLL_INTERVAL
+        self.stopping = threading.Event()
+
+    def claim(self, limit):
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(Job.objects.select_for_update(skip_locked=True).filter(
+                status=Job.QUEUED, run_at__lte=now,
+            )[:limit])
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=Job.RUNNING, started_at=now,
+                attempts=F('attempts') + 1,
+            )
+        for job in jobs:
+            job.status = Job.RUNNING
+            job.started_at = now
+            job.attempts += 1
+        return jobs
+
+    def requeue_stale(self):
+        """ Задачи упавшего воркера возвращаются в очередь как неудачные. """
+        stale = Job.objects.filter(
+            status=Job.RUNNING,
+            started_at__lt=timezone.now() - timedelta(
+                seconds=settings.JOBS_STALE_AFTER
+            ),
+        )
+        for job in stale:
+            self.retry(job, 'Воркер не завершил задачу вовремя.')
+
+    def retry(self, job, error):
+        if job.attempts >= settings.JOBS_MAX_ATTEMPTS:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, last_error=error
+            )
+            return 'failed'
+
+        delay = settings.JOBS_RETRY_DELAY * 2 ** max(0, job.attempts - 1)
+        try:
+            with transaction.atomic():
+                Job.objects.filter(pk=job.pk).update(
+                    status=Job.QUEUED, last_error=error,
+                    run_at=timezone.now() + timedelta(seconds=delay),
+                )
+        except IntegrityError:
+            # Та же задача уже снова в очереди, она и выполнит работу.
+            Job.objects.filter(pk=job.pk).delete()
+        return 'retry'
+
+    def execute(self, job):
+        job_wait.observe(
+            max(0, (job.started_at - job.run_at).total_seconds()),
+            name=job.name,
+        )
+        started = time.monotonic()
+        try:
+            func = tasks.get(job.name)
+            if func is None:
+                raise LookupError(f'Неизвестная задача {job.name}')
+            func(*job.args)
+        except Exception:
+            logger.exception('Ошибка задачи %s', job)
+            result = self.retry(job, traceback.format_exc())
+        else:
+            Job.objects.filter(pk=job.pk).delete()
+            result = 'done'
+        finally:
+            connection.close()
+        job_duration.observe(
+            time.monotonic() - started, name=job.name, result=result
+        )
+        return result
+
+    def run(self, burst=False):
+        """ Цикл воркера; с burst - до опустошения очереди. """
+        running = set()
+        next_stale_check = 0
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='job'
+        ) as pool:
+            while not self.stopping.is_set():
+                if time.monotonic() >= next_stale_check:
+                    self.requeue_stale()
+                    next_stale_check = (
+                        time.monotonic() + settings.JOBS_STALE_AFTER
+                    )
+                free = self.concurrency - len(running)
+                jobs = self.claim(free) if free else []
+                running.update(pool.submit(self.execute, job) for job in jobs)
+                if jobs:
+                    continue
+                if burst and not running:
+                    break
+                if running:
+                    running = wait(
+                        running, self.poll_interval,
+                        return_when=FIRST_COMPLETED,
+                    ).not_done
+                else:
+                    self.stopping.wait(self.poll_interval)
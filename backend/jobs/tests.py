@@ -0,0 +1,94 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import Worker, enqueue, task
+from recipes.models import Recipe, User
+
+calls = []
+
+
+@task
+def record(value):
+    calls.append(value)
+
+
+@task
+def fail():
+    raise ValueError('boom')
+
+
+@override_settings(JOBS_INLINE=False)
+class QueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def run_due(self):
+        worker = Worker(concurrency=1)
+        # Воркер закрывает соединение после задачи, в тесте оно общее.
+        with mock.patch.object(connection, 'close'):
+            return [worker.execute(job) for job in worker.claim(10)]
+
+    def test_dedup_while_queued(self):
+        enqueue(record, 1, dedup_key='record')
+        enqueue(record, 2, dedup_key='record')
+        enqueue(record, 3)
+        self.assertEqual(self.run_due(), ['done', 'done'])
+        self.assertEqual(sorted(calls), [1, 3])
+
+        enqueue(record, 4, dedup_key='record')
+        self.assertEqual(Job.objects.filter(dedup_key='record').count(), 1)
+
+    def test_delayed_job_waits(self):
+        enqueue(record, 1, delay=60)
+        self.assertEqual(self.run_due(), [])
+        self.assertEqual(calls, [])
+
+    @override_settings(JOBS_MAX_ATTEMPTS=2, JOBS_RETRY_DELAY=10)
+    def test_retry_with_backoff_then_fail(self):
+        enqueue(fail)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(self.run_due(), ['retry'])
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(
+            (job.run_at - timezone.now()).total_seconds(), 9
+        )
+        self.assertIn('ValueError', job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(self.run_due(), ['failed'])
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+
+@override_settings(JOBS_INLINE=True)
+class InlineJobsTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_dedup_within_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue(record, 1, dedup_key='record')
+            enqueue(record, 2, dedup_key='record')
+            enqueue(record, 3)
+            enqueue(record, 4, delay=60)
+        self.assertEqual(calls, [1, 3])
+        self.assertFalse(Job.objects.exists())
+
+    def test_recipe_save_skips_similarity_rebuild(self):
+        user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret',
+            first_name='Повар', last_name='Поваров',
+        )
+        with mock.patch('recipes.jobs.call_command') as command:
+            with self.captureOnCommitCallbacks(execute=True):
+                Recipe.objects.create(
+                    author=user, name='Блины', text='Текст', cooking_time=10,
+                )
+        command.assert_not_called()
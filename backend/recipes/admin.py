@@ -2,6 +2,8 @@ from django.contrib import admin
 from django.contrib.admin import TabularInline
 from django.utils.safestring import mark_safe
 
+from recipes.admin_utils import (AuthorFilter, EstimatedCountPaginator,
+                                 UserFilter)
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                             ShoppingСart, Tag)
 
@@ -9,13 +11,15 @@ from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
-    search_fields = ('name', 'measurement_unit',)
-    list_filter = ('name',)
+    search_fields = ('^name',)
     empty_value_display = '- пусто -'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class IngredientRecipeInline(TabularInline):
     model = IngredientRecipe
+    autocomplete_fields = ('ingredient',)
     min_num = 1
     extra = 1
 
@@ -33,18 +37,26 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'author', 'name', 'get_ingredients',
                     'get_tags', 'favorite')
     fields = ('name', 'author', 'text', 'image',)
-    search_fields = ('name', 'author', 'tags')
-    list_filter = ('name', 'author', 'tags')
+    search_fields = ('^name',)
+    list_filter = (AuthorFilter, 'tags')
+    autocomplete_fields = ('author',)
     inlines = (IngredientRecipeInline,)
     empty_value_display = '- пусто -'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related('tags', 'ingredients')
 
     @admin.display(description='Изображение')
     def get_image(self, obj):
         return mark_safe(f'<img src={obj.image.url} width="80" hieght="30"')
 
-    @admin.display(description='Избранное')
+    @admin.display(description='Избранное', ordering='favorites_count')
     def favorite(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
     @admin.display(description='Ингредиенты')
     def get_ingredients(self, obj):
@@ -59,15 +71,22 @@ class RecipeAdmin(admin.ModelAdmin):
         return ', '.join(ls)
 
 
-@admin.register(ShoppingСart)
-class ShoppingAdmin(admin.ModelAdmin):
+class UserRecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe',)
-    search_fields = ('user', 'recipe', )
+    list_select_related = ('user', 'recipe')
+    search_fields = ('^recipe__name', )
+    list_filter = (UserFilter,)
+    autocomplete_fields = ('user', 'recipe')
     empty_value_display = '- пусто -'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(ShoppingСart)
+class ShoppingAdmin(UserRecipeAdmin):
+    pass
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'recipe',)
-    search_fields = ('user', 'recipe', )
-    empty_value_display = '- пусто -'
+class FavoriteAdmin(UserRecipeAdmin):
+    pass
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import transaction
+from sorl.thumbnail import get_thumbnail
+
+from api.caches import recipes_cache
+from recipes.models import Recipe
+
+
+def variants_outdated(recipe):
+    source = recipe.image.name if recipe.image else None
+    return recipe.image_variants.get('source') != source
+
+
+def build_image_variants(recipe):
+    """ Готовит уменьшенные копии фото во всех размерах и форматах. """
+    variants = {}
+    if recipe.image:
+        variants['source'] = recipe.image.name
+        sizes = settings.RECIPE_IMAGE_VARIANTS
+        for size, (geometry, options) in sizes.items():
+            variants[size] = {
+                image_format.lower(): get_thumbnail(
+                    recipe.image, geometry, format=image_format, **options
+                ).name
+                for image_format in settings.RECIPE_IMAGE_FORMATS
+            }
+
+    # update() без post_save: копии фото не меняют ни поиск, ни похожие
+    # рецепты, сбросить нужно только кэш ответов.
+    recipe.image_variants = variants
+    Recipe.objects.filter(pk=recipe.pk).update(image_variants=variants)
+    transaction.on_commit(recipes_cache.bump)
@@ -0,0 +1,21 @@
+from django.core.management import call_command
+
+from jobs.queue import task
+from recipes.images import build_image_variants, variants_outdated
+from recipes.models import Recipe
+
+
+@task
+def update_image_variants(recipe_id):
+    """ Копии фото, если к моменту выполнения они ещё устарели. """
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'id', 'image', 'image_variants'
+    ).first()
+    if recipe is not None and variants_outdated(recipe):
+        build_image_variants(recipe)
+
+
+@task
+def refresh_similar_recipes():
+    """ Пересчёт похожих рецептов для изменённых с прошлого расчёта. """
+    call_command('build_similar_recipes', incremental=True, verbosity=0)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_image_variants, variants_outdated
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Готовит уменьшенные копии фото рецептов, где их ещё нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать копии у всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        built = 0
+        recipes = Recipe.objects.only('id', 'image', 'image_variants')
+        for recipe in recipes.iterator():
+            if options['all'] or variants_outdated(recipe):
+                build_image_variants(recipe)
+                built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Копии фотографий подготовлены для {built} рецептов'
+        ))
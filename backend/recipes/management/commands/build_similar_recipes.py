@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeSimilarity
+from recipes.similarity import SimilarityModel, feature_matrix
+
+
+class Command(BaseCommand):
+    help = (
+        'Рассчитывает похожие рецепты по ингредиентам и тегам и сохраняет '
+        'top-K для каждого рецепта. С --incremental пересчитывает только '
+        'рецепты, изменённые с прошлого расчёта, и их соседей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=settings.SIMILAR_RECIPES_TOP_K,
+        )
+        parser.add_argument(
+            '--metric', choices=SimilarityModel.metrics, default='cosine',
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=None,
+            help='Строк в блоке; по умолчанию по лимиту памяти.',
+        )
+        parser.add_argument('--incremental', action='store_true')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        computed_at = timezone.now()
+        self.top_k = options['top_k']
+        self.recipe_ids = np.array(
+            sorted(Recipe.objects.values_list('id', flat=True)),
+            dtype=np.int64,
+        )
+        self.model = SimilarityModel(
+            feature_matrix(self.recipe_ids), options['metric']
+        )
+        self.block_size = self.model.block_size(options['block_size'])
+
+        if options['incremental']:
+            changed = list(Recipe.objects.filter(
+                Q(similarity_computed_at__isnull=True)
+                | Q(updated_at__gt=F('similarity_computed_at'))
+            ).values_list('id', flat=True))
+            targets = self.affected(changed)
+        else:
+            changed = None
+            targets = np.arange(len(self.recipe_ids))
+
+        for start in range(0, len(targets), self.block_size):
+            self.save(targets[start:start + self.block_size])
+
+        marked = Recipe.objects.all()
+        if changed is not None:
+            marked = marked.filter(pk__in=changed)
+        marked.update(similarity_computed_at=computed_at)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты пересчитаны для {len(targets)} рецептов '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+
+    def positions(self, ids):
+        ids = np.asarray(sorted(ids), dtype=np.int64)
+        positions = np.searchsorted(self.recipe_ids, ids)
+        known = positions < len(self.recipe_ids)
+        known[known] = self.recipe_ids[positions[known]] == ids[known]
+        return positions[known]
+
+    def affected(self, changed):
+        """
+        Изменённые рецепты, рецепты, у которых они уже в top-K, и рецепты,
+        в чей top-K они теперь попадают.
+        """
+        affected = set(changed)
+        affected.update(RecipeSimilarity.objects.filter(
+            similar__in=changed
+        ).values_list('recipe_id', flat=True))
+
+        # Порог входа в top-K: худший из K соседей, а если соседей
+        # меньше K - любое положительное сходство.
+        thresholds = np.zeros(len(self.recipe_ids), dtype=np.float32)
+        current = np.array(list(
+            RecipeSimilarity.objects.values('recipe').annotate(
+                lowest=Min('score'), total=Count('id'),
+            ).filter(total__gte=self.top_k).values_list('recipe', 'lowest')
+        ), dtype=np.float64).reshape(-1, 2)
+        positions = np.searchsorted(self.recipe_ids, current[:, 0])
+        known = positions < len(self.recipe_ids)
+        thresholds[positions[known]] = current[known, 1]
+
+        changed_positions = self.positions(changed)
+        for start in range(0, len(changed_positions), self.block_size):
+            block = self.model.scores(
+                changed_positions[start:start + self.block_size]
+            )
+            hits = (block > thresholds[None, :]).any(axis=0)
+            affected.update(self.recipe_ids[hits].tolist())
+        return self.positions(affected)
+
+    def save(self, rows):
+        neighbours, scores = self.model.top_k(
+            self.model.scores(rows), self.top_k
+        )
+        links = [
+            RecipeSimilarity(
+                recipe_id=int(self.recipe_ids[row]),
+                similar_id=int(self.recipe_ids[neighbour]),
+                score=float(score),
+            )
+            for row, row_neighbours, row_scores in zip(
+                rows, neighbours, scores
+            )
+            for neighbour, score in zip(row_neighbours, row_scores)
+            if score > 0
+        ]
+        with transaction.atomic():
+            RecipeSimilarity.objects.filter(
+                recipe_id__in=self.recipe_ids[rows].tolist()
+            ).delete()
+            RecipeSimilarity.objects.bulk_create(links, batch_size=1000)
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from recipes.models import IngredientRecipe, ShoppingListItem, ShoppingСart
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает таблицу итогов списков покупок по корзинам '
+        'пользователей или, с --verify, только сверяет её.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только проверить расхождения, ничего не меняя.',
+        )
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = sorted(set(
+            ShoppingСart.objects.values_list('user', flat=True)
+        ) | set(
+            ShoppingListItem.objects.values_list('user', flat=True)
+        ))
+        chunk_size = options['chunk_size']
+        mismatched = 0
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            if options['verify']:
+                mismatched += self.verify(chunk)
+            else:
+                ShoppingListItem.objects.refresh(chunk)
+
+        if options['verify']:
+            if mismatched:
+                raise CommandError(
+                    f'Расхождений в списках покупок: {mismatched}'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок совпадают ({len(user_ids)} польз.)'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок пересобраны ({len(user_ids)} польз.)'
+            ))
+
+    def verify(self, user_ids):
+        expected = {}
+        totals = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user__in=user_ids
+        ).values(
+            'recipe__shopping_cart__user', 'ingredient',
+        ).annotate(total=Sum('amount')).order_by()
+        for item in totals:
+            key = (item['recipe__shopping_cart__user'], item['ingredient'])
+            expected[key] = item['total']
+
+        actual = {
+            (user, ingredient): total
+            for user, ingredient, total in ShoppingListItem.objects.filter(
+                user__in=user_ids
+            ).values_list('user', 'ingredient', 'total')
+        }
+        mismatched = 0
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                mismatched += 1
+                self.stderr.write(
+                    f'user={key[0]} ingredient={key[1]}: '
+                    f'ожидалось {expected.get(key)}, '
+                    f'в таблице {actual.get(key)}'
+                )
+        return mismatched
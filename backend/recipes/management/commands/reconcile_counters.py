@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingСart, User
+from users.models import Follow
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingСart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by().values(field)
+            .annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные счётчики рецептов и пользователей '
+        'с фактическими данными и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только проверить расхождения, ничего не меняя.',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        with transaction.atomic():
+            for model, counter, source, field in COUNTERS:
+                actual = actual_count(source, field)
+                drifted = model.objects.alias(actual=actual).exclude(
+                    **{counter: F('actual')}
+                )
+                count = drifted.count()
+                if count and not options['verify']:
+                    model.objects.filter(
+                        pk__in=drifted.values('pk')
+                    ).update(**{counter: actual})
+                total += count
+                self.stdout.write(
+                    f'{model._meta.model_name}.{counter}: '
+                    f'расхождений {count}'
+                )
+
+        if options['verify'] and total:
+            raise CommandError(f'Расхождений в счётчиках: {total}')
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые векторы рецептов (только PostgreSQL).'
+
+    def handle(self, *args, **options):
+        updated = Recipe.objects.all().update_search_vector()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковые векторы пересчитаны: {updated}'
+        ))
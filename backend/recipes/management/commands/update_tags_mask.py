@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает битовые маски тегов у всех рецептов.'
+
+    def handle(self, *args, **options):
+        Recipe.objects.all().update_tags_mask()
+        self.stdout.write(self.style.SUCCESS('Маски тегов пересчитаны'))
@@ -1,14 +1,119 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import connections, models, transaction
+from django.db.models import (F, Lookup, Prefetch, Sum, UniqueConstraint,
+                              Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
 from foodgram.settings import MAX_LENGHT_2
 from users.validators import validate_name
 
 User = get_user_model()
 
+# Теги с id не больше TAG_MASK_BITS входят в битовую маску Recipe.tags_mask.
+TAG_MASK_BITS = 62
+
+
+SEARCH_CONFIG = 'russian'
+
+# Поисковый вектор рецепта: название (вес A), ингредиенты (B), описание (C).
+SEARCH_VECTOR_SQL = f"""
+    setweight(to_tsvector('{SEARCH_CONFIG}',
+        coalesce("recipes_recipe"."name", '')), 'A')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+        SELECT string_agg(i.name, ' ')
+        FROM recipes_ingredientrecipe ir
+        JOIN recipes_ingredient i ON i.id = ir.ingredient_id
+        WHERE ir.recipe_id = "recipes_recipe"."id"
+    ), '')), 'B')
+    || setweight(to_tsvector('{SEARCH_CONFIG}',
+        coalesce("recipes_recipe"."text", '')), 'C')
+"""
+
+
+class SearchVectorField(models.Field):
+    """
+    Колонка tsvector на PostgreSQL. django.contrib.postgres не подходит:
+    без psycopg2 (локально на SQLite) он не импортируется.
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'tsvector'
+        return 'text'
+
+
+@SearchVectorField.register_lookup
+class SearchMatch(Lookup):
+    """ search_vector__matches='текст запроса' """
+    lookup_name = 'matches'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        sql = f"{lhs} @@ plainto_tsquery('{SEARCH_CONFIG}', {rhs})"
+        return sql, lhs_params + rhs_params
+
+
+def shift_counter(queryset, field, delta):
+    """
+    Сдвигает денормализованный счётчик выражением F() в той же транзакции,
+    что и основная запись. Ниже нуля счётчик не опускается.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+class CounterShifts(threading.local):
+    """
+    Сдвиги счётчиков из сигналов. Обычно применяются сразу, а внутри
+    batch() копятся по строкам и при выходе применяются одним UPDATE
+    на поле и величину сдвига: так пакетное удаление через delete()
+    не делает запрос на каждую удалённую строку.
+    """
+
+    def __init__(self):
+        self.pending = None
+
+    def shift(self, model, pk, field, delta):
+        if self.pending is None:
+            shift_counter(model.objects.filter(pk=pk), field, delta)
+        else:
+            self.pending[(model, field, pk)] += delta
+
+    @contextmanager
+    def batch(self):
+        self.pending = defaultdict(int)
+        try:
+            yield
+            pending = self.pending
+        finally:
+            self.pending = None
+
+        groups = defaultdict(list)
+        for (model, field, pk), delta in pending.items():
+            if delta:
+                groups[(model, field, delta)].append(pk)
+        for (model, field, delta), pks in groups.items():
+            shift_counter(model.objects.filter(pk__in=pks), field, delta)
+
+
+counter_shifts = CounterShifts()
+
+
+def tag_mask(tag_id):
+    """ Бит тега в маске рецепта или 0, если тег в маску не помещается. """
+    if 0 < tag_id <= TAG_MASK_BITS:
+        return 1 << (tag_id - 1)
+    return 0
+
 
 class Tag(models.Model):
     name = models.CharField(
@@ -37,6 +142,10 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return tag_mask(self.pk)
+
 
 class Ingredient(models.Model):
     name = models.CharField(
@@ -64,6 +173,69 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}.'
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """ Автор, теги и ингредиенты рецептов одним набором запросов. """
+        return self.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredientrecipes',
+                queryset=IngredientRecipe.objects.select_related('ingredient'),
+            ),
+        )
+
+    def update_search_vector(self):
+        """ Пересчитывает search_vector; нужен только на PostgreSQL. """
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=RawSQL(
+            SEARCH_VECTOR_SQL, (), output_field=SearchVectorField()
+        ))
+
+    def update_tags_mask(self):
+        """ Пересчитывает tags_mask у рецептов выборки по TagRecipe. """
+        masks = defaultdict(int)
+        links = TagRecipe.objects.filter(recipe__in=self.values('pk'))
+        for recipe_id, tag_id in links.values_list('recipe_id', 'tag_id'):
+            masks[recipe_id] |= tag_mask(tag_id)
+
+        self.model.objects.bulk_update(
+            [
+                self.model(pk=pk, tags_mask=masks[pk])
+                for pk in self.values_list('pk', flat=True)
+            ],
+            ['tags_mask'],
+            batch_size=1000,
+        )
+
+    def latest_by_author(self, author_ids, limit=None):
+        """
+        Последние рецепты авторов одним запросом, не больше limit
+        на каждого автора: ROW_NUMBER() OVER (PARTITION BY author).
+        """
+        queryset = self.filter(author_id__in=author_ids).only(
+            'id', 'author_id', 'name', 'image', 'image_variants',
+            'cooking_time', 'pub_date',
+        )
+        if limit is None:
+            return list(queryset.order_by('author_id', '-pub_date'))
+
+        queryset = queryset.annotate(author_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('author_id'),
+            order_by=F('pub_date').desc(),
+        )).order_by()
+        sql, params = queryset.query.sql_with_params()
+        return list(self.model.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE ranked.author_rank <= %s '
+            'ORDER BY ranked.author_id, ranked.author_rank',
+            (*params, limit),
+        ))
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -94,6 +266,33 @@ class Recipe(models.Model):
         upload_to='recipes/image/',
         blank=True,
     )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Битовая маска тегов',
+        default=0,
+        db_index=True,
+        editable=False,
+    )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии фотографии',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
         max_length=500,
@@ -102,16 +301,42 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения'
+    )
+    similarity_computed_at = models.DateTimeField(
+        verbose_name='Дата расчёта похожих рецептов',
+        null=True,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         default=0,
         validators=[MinValueValidator(1), MaxValueValidator(600)],
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=('-pub_date', 'id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-pub_date', 'id'),
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', 'id'),
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -229,3 +454,174 @@ class ShoppingСart(FavoriteShoppingCartModel):
                 name='unique_recipe_in_shopping_cart'
             )
         ]
+
+
+class ShoppingListItemManager(models.Manager):
+
+    def refresh(self, users, ingredients=None):
+        """
+        Пересчитывает итоги списка покупок users по ingredients
+        (по всем ингредиентам, если None). И users, и ingredients
+        могут быть списком id или подзапросом.
+        """
+        items = self.filter(user__in=users)
+        totals = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user__in=users
+        )
+        if ingredients is not None:
+            items = items.filter(ingredient__in=ingredients)
+            totals = totals.filter(ingredient__in=ingredients)
+
+        totals = totals.values(
+            'recipe__shopping_cart__user', 'ingredient',
+        ).annotate(total=Sum('amount')).order_by()
+
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(pk__in=users))
+            items.delete()
+            self.bulk_create(
+                self.model(
+                    user_id=item['recipe__shopping_cart__user'],
+                    ingredient_id=item['ingredient'],
+                    total=item['total'],
+                )
+                for item in totals
+            )
+
+    def refresh_recipe(self, recipe, ingredients=None, users=None):
+        """ Пересчёт у всех, чья корзина содержит recipe. """
+        if ingredients is None:
+            ingredients = recipe.ingredientrecipes.values('ingredient')
+        if users is None:
+            users = list(
+                recipe.shopping_cart.values_list('user', flat=True)
+            )
+        if users:
+            self.refresh(users, ingredients)
+
+
+class ShoppingListItem(models.Model):
+    """ Итог по ингредиенту в списке покупок, поддерживается при записи. """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+    )
+    total = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок по ингредиентам'
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-total'),
+                name='shopping_list_user_total_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient.name} - {self.total}'
+
+
+class RecipeSimilarity(models.Model):
+    """ Заранее рассчитанные похожие рецепты (top-K по каждому рецепту). """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_links',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_recipe_similarity'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('recipe', '-score'),
+                name='recipe_similarity_score_idx'
+            )
+        ]
+
+
+class FeedItem(models.Model):
+    """
+    Лента подписок пользователя при FEED_STRATEGY = 'fanout': запись на
+    каждый рецепт автора, на которого он подписан. Дата публикации
+    скопирована из рецепта, чтобы лента читалась по индексу без JOIN.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Читатель',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации рецепта',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_item'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', 'recipe'),
+                name='feed_item_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='feed_item_user_author_idx'
+            ),
+        ]
@@ -0,0 +1,220 @@
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from jobs.queue import enqueue
+from recipes import jobs as recipe_jobs
+from recipes.images import variants_outdated
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, ShoppingСart, User,
+                            counter_shifts)
+from users.models import Follow
+
+INDEXES_SQL = (
+    # istartswith на PostgreSQL превращается в UPPER(name::text) LIKE ...,
+    # обычный индекс по name для такого выражения не подходит.
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_like '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)',
+    # Поиск в админке по префиксу (search_fields с '^').
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_name_upper_like '
+    'ON recipes_recipe (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS users_user_username_upper_like '
+    'ON users_user (UPPER(username::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS users_user_email_upper_like '
+    'ON users_user (UPPER(email::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+
+
+def create_search_indexes(using, **kwargs):
+    """ Функциональные индексы, которые Django 3.2 не умеет описывать. """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for sql in INDEXES_SQL:
+            cursor.execute(sql)
+
+
+@receiver(post_save, sender=Recipe)
+def update_image_variants(instance, raw=False, **kwargs):
+    if not raw and variants_outdated(instance):
+        enqueue(
+            recipe_jobs.update_image_variants, instance.pk,
+            dedup_key=f'image-variants:{instance.pk}',
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_similar_recipes(raw=False, **kwargs):
+    if raw:
+        return
+    # Правки за SIMILAR_RECIPES_REFRESH_DELAY секунд сливаются в один расчёт.
+    enqueue(
+        recipe_jobs.refresh_similar_recipes, dedup_key='similar-recipes',
+        delay=settings.SIMILAR_RECIPES_REFRESH_DELAY,
+    )
+
+
+def update_search_vector_on_commit(queryset):
+    transaction.on_commit(queryset.update_search_vector)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(instance, raw=False, **kwargs):
+    if not raw:
+        update_search_vector_on_commit(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def update_search_vector_for_link(instance, raw=False, **kwargs):
+    if not raw:
+        update_search_vector_on_commit(
+            Recipe.objects.filter(pk=instance.recipe_id)
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+def update_search_vector_for_ingredient(instance, created, raw=False,
+                                        **kwargs):
+    if not created and not raw:
+        update_search_vector_on_commit(
+            Recipe.objects.filter(ingredientrecipes__ingredient=instance)
+        )
+
+
+# Только m2m_changed: set() добавляет связи через bulk_create без
+# post_save у TagRecipe, а сигналы удаления дублировали бы пересчёт.
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tags_mask(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).update_tags_mask()
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).update_tags_mask()
+    else:
+        Recipe.objects.all().update_tags_mask()
+
+
+def counter_delta(created=True, raw=False, signal=None, **kwargs):
+    if signal is post_delete:
+        return -1
+    return 1 if created and not raw else 0
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def update_favorites_count(instance, **kwargs):
+    delta = counter_delta(**kwargs)
+    if delta:
+        counter_shifts.shift(
+            Recipe, instance.recipe_id, 'favorites_count', delta
+        )
+
+
+@receiver((post_save, post_delete), sender=ShoppingСart)
+def update_in_carts_count(instance, **kwargs):
+    delta = counter_delta(**kwargs)
+    if delta:
+        counter_shifts.shift(
+            Recipe, instance.recipe_id, 'in_carts_count', delta
+        )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_recipes_count(instance, **kwargs):
+    delta = counter_delta(**kwargs)
+    if delta and instance.author_id:
+        counter_shifts.shift(
+            User, instance.author_id, 'recipes_count', delta
+        )
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def update_followers_count(instance, **kwargs):
+    delta = counter_delta(**kwargs)
+    if delta:
+        counter_shifts.shift(
+            User, instance.author_id, 'followers_count', delta
+        )
+
+
+class PendingShoppingLists(threading.local):
+    """
+    Списки покупок, затронутые в текущей транзакции. Пересчёт идёт после
+    коммита одним запросом: первый колбэк забирает всё накопленное,
+    остальные ничего не делают. Если транзакция откатилась, накопленное
+    пересчитается при следующем коммите - лишний пересчёт безвреден.
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.ingredients = set()
+        self.recipes = set()
+
+    def add(self, users, ingredients=(), recipes=()):
+        """ Ингредиенты recipes выбираются при пересчёте, одним запросом. """
+        users = set(users)
+        if not users:
+            return
+        self.users.update(users)
+        self.ingredients.update(ingredients)
+        self.recipes.update(recipes)
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        users, ingredients, recipes = (
+            self.users, self.ingredients, self.recipes
+        )
+        self.__init__()
+        if recipes:
+            ingredients.update(recipe_ingredients(recipes))
+        if users and ingredients:
+            ShoppingListItem.objects.refresh(
+                sorted(users), sorted(ingredients)
+            )
+
+
+pending_shopping_lists = PendingShoppingLists()
+
+
+def cart_users(recipe_id):
+    return ShoppingСart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user', flat=True)
+
+
+def recipe_ingredients(recipe_ids):
+    return IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredient', flat=True)
+
+
+@receiver(pre_delete, sender=Recipe)
+def refresh_shopping_lists_for_recipe(instance, **kwargs):
+    # Корзины и ингредиенты удаляются каскадом в произвольном порядке,
+    # поэтому затронутых нужно собрать до удаления.
+    pending_shopping_lists.add(
+        cart_users(instance.pk), recipe_ingredients([instance.pk])
+    )
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def refresh_shopping_lists_for_link(instance, raw=False, **kwargs):
+    if not raw:
+        pending_shopping_lists.add(
+            cart_users(instance.recipe_id), [instance.ingredient_id]
+        )
+
+
+@receiver((post_save, post_delete), sender=ShoppingСart)
+def refresh_shopping_list(instance, raw=False, **kwargs):
+    if not raw:
+        pending_shopping_lists.add(
+            [instance.user_id], recipes=[instance.recipe_id]
+        )
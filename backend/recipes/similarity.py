@@ -0,0 +1,96 @@
+import numpy as np
+from scipy import sparse
+
+from recipes.models import IngredientRecipe, TagRecipe
+
+# Сколько ячеек плотного блока сходств считается за раз (float32).
+BLOCK_CELLS = 4_000_000
+
+
+def _links(queryset):
+    return np.array(list(queryset), dtype=np.int64).reshape(-1, 2)
+
+
+def feature_matrix(recipe_ids):
+    """
+    Разреженная матрица рецепт x (ингредиенты + теги) из нулей и единиц.
+    recipe_ids - отсортированный массив id, строки идут в том же порядке.
+    """
+    columns = []
+    links = []
+    offset = 0
+    for queryset in (
+        IngredientRecipe.objects.values_list('recipe_id', 'ingredient_id'),
+        TagRecipe.objects.values_list('recipe_id', 'tag_id'),
+    ):
+        pairs = _links(queryset)
+        features, inverse = np.unique(pairs[:, 1], return_inverse=True)
+        columns.append(inverse.reshape(-1) + offset)
+        links.append(pairs[:, 0])
+        offset += len(features)
+
+    recipes = np.concatenate(links)
+    columns = np.concatenate(columns)
+    rows = np.searchsorted(recipe_ids, recipes)
+    known = rows < len(recipe_ids)
+    known[known] = recipe_ids[rows[known]] == recipes[known]
+    matrix = sparse.csr_matrix(
+        (
+            np.ones(known.sum(), dtype=np.float32),
+            (rows[known], columns[known]),
+        ),
+        shape=(len(recipe_ids), offset),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+class SimilarityModel:
+    """ Сходство рецептов по матрице признаков: cosine или jaccard. """
+    metrics = ('cosine', 'jaccard')
+
+    def __init__(self, matrix, metric='cosine'):
+        if metric not in self.metrics:
+            raise ValueError(f'Неизвестная метрика: {metric}')
+        self.metric = metric
+        self.matrix = matrix
+        self.sizes = np.asarray(matrix.sum(axis=1)).ravel()
+        if metric == 'cosine':
+            norms = np.sqrt(self.sizes)
+            inverse = np.divide(
+                1, norms, out=np.zeros_like(norms), where=norms > 0
+            )
+            self.matrix = sparse.diags(inverse) @ matrix
+        self.transposed = self.matrix.T.tocsc()
+
+    def block_size(self, limit=None):
+        if limit:
+            return limit
+        return max(1, BLOCK_CELLS // max(1, self.matrix.shape[0]))
+
+    def scores(self, rows):
+        """ Плотный блок сходств строк rows со всеми рецептами. """
+        block = (self.matrix[rows] @ self.transposed).toarray()
+        if self.metric == 'jaccard':
+            union = self.sizes[rows, None] + self.sizes[None, :] - block
+            block = np.divide(
+                block, union, out=np.zeros_like(block), where=union > 0
+            )
+        block[np.arange(len(rows)), rows] = 0
+        return block
+
+    @staticmethod
+    def top_k(block, k):
+        """ Для каждой строки блока - позиции и значения k наибольших. """
+        k = min(k, block.shape[1] - 1)
+        if k <= 0:
+            empty = np.empty((block.shape[0], 0))
+            return empty.astype(np.int64), empty
+        part = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        values = np.take_along_axis(block, part, axis=1)
+        order = np.argsort(-values, axis=1, kind='stable')
+        return (
+            np.take_along_axis(part, order, axis=1),
+            np.take_along_axis(values, order, axis=1),
+        )
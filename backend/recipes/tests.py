@@ -0,0 +1,215 @@
+import io
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            ShoppingСart, Tag, User)
+
+
+@override_settings(JOBS_INLINE=False)
+class ShoppingListTests(TestCase):
+    """ Итоги списка покупок пересчитываются и при записи мимо API. """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret',
+            first_name='Повар', last_name='Поваров',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes = self.add_to_cart('Блины', 200)
+            self.pie = self.add_to_cart('Пирог', 300)
+
+    def add_to_cart(self, name, amount):
+        recipe = Recipe.objects.create(
+            author=self.user, name=name, text='Текст', cooking_time=10,
+            image='recipes/images/dish.jpg',
+        )
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=self.flour, amount=amount
+        )
+        ShoppingСart.objects.create(user=self.user, recipe=recipe)
+        return recipe
+
+    def download(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'json'}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.getvalue().decode()
+
+    def test_totals_after_recipe_delete(self):
+        self.assertIn('500', self.download())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pie.delete()
+
+        body = self.download()
+        self.assertIn('200', body)
+        self.assertNotIn('500', body)
+
+    def test_totals_after_amount_change(self):
+        self.download()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link = IngredientRecipe.objects.get(recipe=self.pancakes)
+            link.amount = 100
+            link.save()
+
+        self.assertIn('400', self.download())
+
+    def test_not_modified_until_cart_changes(self):
+        url = '/api/recipes/download_shopping_cart/'
+        response = self.client.get(url, {'format': 'txt'})
+        self.assertIn('мука (г) - 500', response.getvalue().decode())
+        etag = response['ETag']
+
+        response = self.client.get(
+            url, {'format': 'txt'}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, {'format': 'csv'}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingСart.objects.filter(recipe=self.pie).delete()
+        response = self.client.get(
+            url, {'format': 'txt'}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('мука (г) - 200', response.getvalue().decode())
+
+
+class TagsMaskTests(TestCase):
+    """ Битовая маска тегов следует за recipe.tags и фильтром ?tags=. """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret',
+            first_name='Повар', last_name='Поваров',
+        )
+        self.breakfast, self.lunch = (
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#00ff7f', 'breakfast'),
+                ('Обед', '#f754e1', 'lunch'),
+            )
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Каша', text='Текст', cooking_time=10,
+            image='recipes/images/dish.jpg',
+        )
+
+    def mask(self):
+        self.recipe.refresh_from_db(fields=('tags_mask',))
+        return self.recipe.tags_mask
+
+    def filtered(self, slug):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/recipes/', {'tags': slug})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_mask_follows_tags(self):
+        self.recipe.tags.set([self.breakfast, self.lunch])
+        self.assertEqual(self.mask(), self.breakfast.mask | self.lunch.mask)
+        self.assertEqual(self.filtered('lunch'), [self.recipe.pk])
+
+        self.recipe.tags.remove(self.lunch)
+        self.assertEqual(self.mask(), self.breakfast.mask)
+        self.assertEqual(self.filtered('lunch'), [])
+
+        self.lunch.recipes.add(self.recipe)
+        self.assertEqual(self.mask(), self.breakfast.mask | self.lunch.mask)
+
+        self.recipe.tags.clear()
+        self.assertEqual(self.mask(), 0)
+        self.assertEqual(self.filtered('breakfast'), [])
+
+    def test_set_recomputes_mask_once(self):
+        self.recipe.tags.set([self.breakfast])
+        with CaptureQueriesContext(connection) as context:
+            self.recipe.tags.set([self.lunch])
+        updates = [
+            query for query in context.captured_queries
+            if 'tags_mask' in query['sql']
+            and query['sql'].startswith('UPDATE')
+        ]
+        self.assertEqual(len(updates), 2)
+
+
+class SimilarRecipesTests(TestCase):
+    """ top-K похожих рецептов по ингредиентам. """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret',
+            first_name='Повар', last_name='Поваров',
+        )
+        self.a, self.b, self.c, self.d = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in 'abcd'
+        )
+        self.base = self.create('База', self.a, self.b, self.c)
+        self.close = self.create('Близкий', self.a, self.b, self.c, self.d)
+        self.middle = self.create('Средний', self.a, self.b)
+        self.weak = self.create('Дальний', self.a)
+        self.other = self.create('Другой', self.d)
+
+    def create(self, name, *ingredients):
+        recipe = Recipe.objects.create(
+            author=self.user, name=name, text='Текст', cooking_time=10,
+            image='recipes/images/dish.jpg',
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=item, amount=1)
+            for item in ingredients
+        )
+        return recipe
+
+    @staticmethod
+    def build(**options):
+        call_command('build_similar_recipes', stdout=io.StringIO(), **options)
+
+    def similar(self, recipe):
+        response = APIClient().get(f'/api/recipes/{recipe.pk}/similar/')
+        return [(item['id'], item['score']) for item in response.data]
+
+    def test_top_k_by_cosine(self):
+        for block_size in (1, None):
+            with self.subTest(block_size=block_size):
+                self.build(top_k=2, block_size=block_size)
+                self.assertEqual(self.similar(self.base), [
+                    (self.close.pk, 0.866), (self.middle.pk, 0.8165),
+                ])
+
+    def test_incremental_update_reaches_neighbours(self):
+        self.build(top_k=2)
+        IngredientRecipe.objects.filter(recipe=self.other).delete()
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=self.other, ingredient=item, amount=1)
+            for item in (self.a, self.b, self.c)
+        )
+        Recipe.objects.filter(pk=self.other.pk).update(
+            updated_at=timezone.now()
+        )
+
+        self.build(top_k=2, incremental=True)
+        self.assertEqual(self.similar(self.base), [
+            (self.other.pk, 1.0), (self.close.pk, 0.866),
+        ])
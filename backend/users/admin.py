@@ -1,30 +1,51 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+from recipes.admin_utils import EstimatedCountPaginator, InputFilter
 from users.models import Follow, User
 
 
+class EmailFilter(InputFilter):
+    title = 'почта'
+    parameter_name = 'email'
+    lookup = 'email__istartswith'
+
+
+class UsernameFilter(InputFilter):
+    title = 'логин'
+    parameter_name = 'username'
+    lookup = 'username__istartswith'
+
+
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     list_display = ('username', 'id', 'email', 'first_name',
                     'last_name', 'quantity_recipes',
                     'quantity_followers')
     list_display_links = ('username', 'id')
-    list_filter = ('email', 'username',)
-    search_fields = ('username', 'email',)
+    list_filter = (EmailFilter, UsernameFilter,)
+    search_fields = ('^username', '^email',)
     empty_value_display = '- пусто -'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    @admin.display(description='Количество рецептов')
+    @admin.display(description='Количество рецептов', ordering='recipes_count')
     def quantity_recipes(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
-    @admin.display(description='Количество подписчиков')
+    @admin.display(
+        description='Количество подписчиков', ordering='followers_count'
+    )
     def quantity_followers(self, obj):
-        return obj.follower.count()
+        return obj.followers_count
 
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
     list_display = ('user', 'id', 'author',)
-    search_fields = ('user__email', 'author__email',)
+    list_select_related = ('user', 'author')
+    search_fields = ('^user__email', '^author__email',)
+    autocomplete_fields = ('user', 'author')
     empty_value_display = '- пусто -'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
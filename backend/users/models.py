@@ -35,6 +35,16 @@ class User(AbstractUser):
         verbose_name='Пароль',
         max_length=MAX_LENGHT_1,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('username', )